@@ -0,0 +1,48 @@
+import os
+import time
+
+import numpy as np
+from langchain.embeddings import HuggingFaceEmbeddings
+
+from evaluation.embeddings.questions import QUERIES
+from src.initialize import _init_config
+from src.service.onnx_embeddings import OnnxEmbeddings
+
+config_loader = _init_config()
+questions = [question for _, question in QUERIES]
+
+pytorch_embeddings = HuggingFaceEmbeddings(
+    model_name=config_loader["embeddings_model_name"],
+    model_kwargs={"device": "cpu"},
+)
+onnx_embeddings = OnnxEmbeddings(
+    model_name=config_loader["embeddings_model_name"],
+    model_dir=os.path.join(os.environ["APP_PATH"], config_loader["onnx_embeddings"]["model_dir"]),
+    quantize=config_loader["onnx_embeddings"]["quantize"],
+    pooling=config_loader["onnx_embeddings"]["pooling"],
+    intra_op_num_threads=config_loader["onnx_embeddings"]["intra_op_num_threads"],
+)
+
+
+def embed_queries(embeddings):
+    embed_query_times = []
+    vectors = []
+    for question in questions:
+        start_time = time.perf_counter()
+        vectors.append(embeddings.embed_query(question))
+        embed_query_times.append(time.perf_counter() - start_time)
+    return np.array(vectors), np.array(embed_query_times)
+
+
+embed_queries(onnx_embeddings)  # warm up
+pytorch_vectors, pytorch_times = embed_queries(pytorch_embeddings)
+onnx_vectors, onnx_times = embed_queries(onnx_embeddings)
+
+cosine = (pytorch_vectors * onnx_vectors).sum(axis=1) / (
+    np.linalg.norm(pytorch_vectors, axis=1) * np.linalg.norm(onnx_vectors, axis=1)
+)
+print(f"Len queries: {len(questions)}")
+print(f"Cosine similarity PyTorch vs ONNX: mean={cosine.mean():.4f} min={cosine.min():.4f}")
+print(f"PyTorch embed_query: median={1000 * np.median(pytorch_times):.1f}ms")
+print(f"ONNX embed_query: median={1000 * np.median(onnx_times):.1f}ms")
+print(f"Speed-up: {np.median(pytorch_times) / np.median(onnx_times):.2f}x")
@@ -2,7 +2,6 @@ import logging as lg
 import os
 import typing as tp
 
-import pinecone
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from retry import retry
@@ -10,6 +9,7 @@ from retry import retry
 from src.etls.common.metadata import MetadataDocument
 from src.etls.common.utils import TextLoader
 from src.initialize import initialize_logging
+from src.service.bm25 import BM25IndexStore
 
 initialize_logging()
 
@@ -22,6 +22,7 @@ class ETL:
     def run(self, docs: tp.List[MetadataDocument]):
         chunks = self._split_documents(docs)
         self._load_database(chunks)
+        self._load_bm25_index(chunks)
         # self._log_database_stats()
 
     def _split_documents(self, docs: tp.List[MetadataDocument]) -> tp.List[Document]:
@@ -54,7 +55,20 @@ class ETL:
         self._vector_store.add_documents(docs_chunks)
         logger.info("Loaded %s embeddings to database", len(docs_chunks))
 
+    def _load_bm25_index(self, docs_chunks: tp.List[Document]) -> None:
+        if not self._config_loader["bm25"]["enabled"]:
+            return
+        bm25_indexes = BM25IndexStore(
+            indexes_dir=os.path.join(os.environ["APP_PATH"], self._config_loader["bm25"]["indexes_dir"]),
+            k1=self._config_loader["bm25"]["k1"],
+            b=self._config_loader["bm25"]["b"],
+            reload_interval_seconds=self._config_loader["bm25"]["reload_interval_seconds"],
+        )
+        bm25_indexes.add_documents(self._vector_store.collection_name, docs_chunks)
+
     def _log_database_stats(self) -> None:
+        import pinecone
+
         logger = lg.getLogger(self._log_database_stats.__name__)
         index_name = self._config_loader["vector_store_index_name"]
         logger.info(pinecone.describe_index(index_name))
@@ -1,21 +1,35 @@
 import collections
+import concurrent.futures
+import contextlib
 import logging as lg
 import os
+import time
 
 import yaml
-from langchain.chains import RetrievalQA
-from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    SystemMessagePromptTemplate,
-)
 from langchain.vectorstores.qdrant import Qdrant
 from openai import AsyncOpenAI
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams
-from tavily import TavilyClient
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+from src.service.admission import AdmissionController
+from src.service.bm25 import BM25IndexStore
+from src.service.cache import AnswerCache, CompletionCache, SemanticAnswerCache, config_version
+from src.service.context import count_tokens
+from src.service.embeddings import BatchingEmbeddingExecutor, CachedEmbeddings
+from src.service.retrieval import collection_index_config
+from src.service.tavily import AsyncTavilyClient
 
 
 def initialize_logging():
@@ -35,16 +49,64 @@ def initialize_app():
     """Initializes the application"""
     logger = lg.getLogger(initialize_app.__name__)
     logger.info("Initializing application")
-    config_loader = _init_config()
-    vector_store = _init_vector_store(config_loader)
-    openai_client = _init_openai_client()
-    tavily_client = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+    timings = {}
+    with _timed(timings, "config"):
+        config_loader = _init_config()
+    with _timed(timings, "vector_store"):
+        vector_store = _init_vector_store(config_loader, timings)
+    with _timed(timings, "clients"):
+        openai_client = _init_openai_client()
+        tavily_client = _init_tavily_client(config_loader)
+    with _timed(timings, "caches"):
+        answer_cache = _init_answer_cache(config_loader)
+        semantic_cache = _init_semantic_cache(config_loader)
     # retrieval_qa = _init_retrieval_qa_llm(vector_store, config_loader)
-    logger.info("Initialized application")
+    logger.info("Initialized application. Startup timings: %s", _format_timings(timings))
     init_objects = collections.namedtuple(
-        "init_objects", ["config_loader", "vector_store", "openai_client", "tavily_client"]
+        "init_objects",
+        [
+            "config_loader",
+            "vector_store",
+            "openai_client",
+            "tavily_client",
+            "answer_cache",
+            "semantic_cache",
+        ],
+    )
+    return init_objects(
+        config_loader,
+        vector_store,
+        openai_client,
+        tavily_client,
+        answer_cache,
+        semantic_cache,
     )
-    return init_objects(config_loader, vector_store, openai_client, tavily_client)
+
+
+def initialize_service():
+    """Initializes the application and the objects only used by the API service, which the ETLs don't load"""
+    init_objects = initialize_app()
+    logger = lg.getLogger(initialize_service.__name__)
+    logger.info("Initializing service")
+    config_loader = init_objects.config_loader
+    timings = {}
+    with _timed(timings, "tokenizer"):
+        # tiktoken downloads the encoding of the model on first use, which must not happen during a request
+        count_tokens("warm up", config_loader["llm_model_name"])
+    with _timed(timings, "completion_cache"):
+        completion_cache = _init_completion_cache(config_loader)
+    with _timed(timings, "bm25_indexes"):
+        bm25_indexes = _init_bm25_indexes(config_loader)
+    with _timed(timings, "reranker"):
+        reranker = _init_reranker(config_loader)
+    with _timed(timings, "async_vector_store"):
+        async_vector_store = _init_async_vector_store(config_loader, init_objects.vector_store)
+    logger.info("Initialized service. Startup timings: %s", _format_timings(timings))
+    service_objects = collections.namedtuple(
+        "service_objects",
+        init_objects._fields + ("completion_cache", "bm25_indexes", "reranker", "async_vector_store"),
+    )
+    return service_objects(*init_objects, completion_cache, bm25_indexes, reranker, async_vector_store)
 
 
 def _init_config():
@@ -54,17 +116,31 @@ def _init_config():
     return config_loader
 
 
-def _init_vector_store(config_loader):
+@contextlib.contextmanager
+def _timed(timings, phase):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - start_time
+
+
+def _format_timings(timings):
+    return ", ".join(f"{phase}={delta:.2f}s" for phase, delta in timings.items())
+
+
+def _init_vector_store(config_loader, timings=None):
     logger = lg.getLogger(_init_vector_store.__name__)
     logger.info("Initializing vector store")
     if config_loader["vector_store"] == "qdrant":
-        vector_store = _init_vector_stores_qdrant(config_loader)
+        vector_store = _init_vector_stores_qdrant(config_loader, {} if timings is None else timings)
     else:
         raise ValueError("Vector Database not configured")
     return vector_store
 
 
-def _init_vector_stores_qdrant(config_loader):
+def _init_vector_stores_qdrant(config_loader, timings):
+    """Loads the embeddings model while the collections are checked (and created if needed) in parallel"""
     logger = lg.getLogger(_init_vector_stores_qdrant.__name__)
     logger.info("Initializing vector stores")
     qdrant_client = QdrantClient(
@@ -72,27 +148,236 @@ def _init_vector_stores_qdrant(config_loader):
         api_key=os.environ["QDRANT_API_KEY"],
         prefer_grpc=True,
     )
-    embeddings = HuggingFaceEmbeddings(
-        model_name=config_loader["embeddings_model_name"],
-        model_kwargs={"device": "cpu"},
-    )
+    if config_loader["embeddings_server"]["enabled"]:
+        # The model lives in the embeddings server process, which also batches the queries of all the workers
+        from src.service.embeddings_server import RemoteEmbeddings
+
+        _init_collections(qdrant_client, config_loader, timings)
+        embeddings = CachedEmbeddings(
+            RemoteEmbeddings(
+                socket_path=config_loader["embeddings_server"]["socket_path"],
+                timeout_seconds=config_loader["embeddings_server"]["timeout_seconds"],
+            ),
+            max_size=config_loader["embeddings_cache"]["max_size"],
+        )
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            embeddings_future = executor.submit(_init_embeddings_model, config_loader, timings)
+            collections_future = executor.submit(_init_collections, qdrant_client, config_loader, timings)
+            base_embeddings = embeddings_future.result()
+            collections_future.result()
+        embeddings = CachedEmbeddings(
+            base_embeddings,
+            max_size=config_loader["embeddings_cache"]["max_size"],
+            batch_executor=BatchingEmbeddingExecutor(
+                base_embeddings,
+                max_batch_size=config_loader["embeddings_batching"]["max_batch_size"],
+                max_wait_ms=config_loader["embeddings_batching"]["max_wait_ms"],
+            ),
+        )
     vector_stores = {}
     for collection_name in config_loader["collections"]:
-        if not _exists_collection(qdrant_client, collection_name):
-            logger.info("Creating collection for vector store")
-            qdrant_client.recreate_collection(
-                collection_name=collection_name,
-                vectors_config=VectorParams(
-                    size=config_loader["embeddings_model_size"], distance=config_loader["distance_type"]
-                ),
-                on_disk_payload=True,
-            )
-            logger.info("Created collection [%s] for vector store", collection_name)
         vector_stores[collection_name] = Qdrant(qdrant_client, collection_name, embeddings)
         logger.info("Initialized vector store for collection [%s]", collection_name)
     return vector_stores
 
 
+def _init_embeddings_model(config_loader, timings):
+    logger = lg.getLogger(_init_embeddings_model.__name__)
+    logger.info("Loading embeddings model")
+    with _timed(timings, "embeddings_model"):
+        if config_loader["embeddings_backend"] == "onnx":
+            from src.service.onnx_embeddings import OnnxEmbeddings
+
+            embeddings = OnnxEmbeddings(
+                model_name=config_loader["embeddings_model_name"],
+                model_dir=os.path.join(os.environ["APP_PATH"], config_loader["onnx_embeddings"]["model_dir"]),
+                quantize=config_loader["onnx_embeddings"]["quantize"],
+                pooling=config_loader["onnx_embeddings"]["pooling"],
+                intra_op_num_threads=config_loader["onnx_embeddings"]["intra_op_num_threads"],
+            )
+        else:
+            embeddings = HuggingFaceEmbeddings(
+                model_name=config_loader["embeddings_model_name"],
+                model_kwargs={"device": "cpu"},
+            )
+    with _timed(timings, "embeddings_warm_up"):
+        # The first forward pass is much slower than the next ones
+        embeddings.embed_query("warm up")
+    logger.info("Loaded embeddings model")
+    return embeddings
+
+
+def _init_collections(qdrant_client, config_loader, timings):
+    with _timed(timings, "collections"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(config_loader["collections"])) as executor:
+            list(
+                executor.map(
+                    lambda collection_name: _init_collection(qdrant_client, collection_name, config_loader),
+                    config_loader["collections"],
+                )
+            )
+
+
+def _init_collection(qdrant_client, collection_name, config_loader):
+    logger = lg.getLogger(_init_collection.__name__)
+    index_config = collection_index_config(config_loader, collection_name)
+    if not _exists_collection(qdrant_client, collection_name):
+        logger.info("Creating collection for vector store")
+        qdrant_client.recreate_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(
+                size=config_loader["embeddings_model_size"],
+                distance=config_loader["distance_type"],
+                on_disk=index_config["vectors_on_disk"],
+            ),
+            hnsw_config=HnswConfigDiff(**index_config["hnsw"]),
+            quantization_config=_quantization_config(index_config),
+            on_disk_payload=True,
+        )
+        logger.info("Created collection [%s] for vector store", collection_name)
+    else:
+        index_changes = _collection_index_changes(qdrant_client, collection_name, index_config)
+        if index_changes:
+            logger.warning(
+                "Collection [%s] differs from its `collection_index` settings (%s), "
+                "apply them with `python -m src.initialize migrate-collections`",
+                collection_name,
+                ", ".join(index_changes),
+            )
+    _init_payload_indexes(qdrant_client, collection_name, config_loader)
+
+
+def migrate_collections():
+    """Applies the `collection_index` settings to the existing collections whose index differs.
+
+    It's a one-off command to run after changing the settings, so the service workers and the ETLs never update the
+    collections concurrently at startup. Qdrant rebuilds the HNSW graph and the quantized vectors in the background, so
+    the searches keep working (with the previous index) meanwhile.
+    """
+    initialize_logging()
+    logger = lg.getLogger(migrate_collections.__name__)
+    config_loader = _init_config()
+    qdrant_client = QdrantClient(url=os.environ["QDRANT_API_URL"], api_key=os.environ["QDRANT_API_KEY"])
+    for collection_name in config_loader["collections"]:
+        if not _exists_collection(qdrant_client, collection_name):
+            continue
+        index_config = collection_index_config(config_loader, collection_name)
+        index_changes = _collection_index_changes(qdrant_client, collection_name, index_config)
+        if not index_changes:
+            logger.info("Collection [%s] is up to date", collection_name)
+            continue
+        logger.info("Updating %s of collection [%s]", ", ".join(index_changes), collection_name)
+        qdrant_client.update_collection(
+            collection_name=collection_name,
+            vectors_config={"": VectorParamsDiff(on_disk=index_config["vectors_on_disk"])},
+            hnsw_config=HnswConfigDiff(**index_config["hnsw"]),
+            quantization_config=_quantization_config(index_config) or Disabled.DISABLED,
+        )
+        logger.info("Updated collection [%s]", collection_name)
+
+
+def _collection_index_changes(qdrant_client, collection_name, index_config):
+    """Settings of `index_config` that differ in the collection. Only the configured fields are compared."""
+    collection_config = qdrant_client.get_collection(collection_name=collection_name).config
+    changes = []
+    if bool(collection_config.params.vectors.on_disk) != index_config["vectors_on_disk"]:
+        changes.append("vectors_on_disk")
+    changes += [
+        f"hnsw.{key}"
+        for key, value in index_config["hnsw"].items()
+        if value is not None and getattr(collection_config.hnsw_config, key) != value
+    ]
+    if not _quantization_matches(collection_config.quantization_config, index_config):
+        changes.append("quantization")
+    return changes
+
+
+def _quantization_matches(quantization_config, index_config):
+    quantization = index_config["quantization"]
+    if quantization is None:
+        return quantization_config is None
+    if quantization == "scalar":
+        # The gRPC API stores the quantile as a float32 (0.99 comes back as 0.9900000095...)
+        return (
+            isinstance(quantization_config, ScalarQuantization)
+            and quantization_config.scalar.type == ScalarType.INT8
+            and quantization_config.scalar.quantile is not None
+            and abs(quantization_config.scalar.quantile - index_config["quantile"]) < 1e-6
+            and bool(quantization_config.scalar.always_ram)
+        )
+    if quantization == "binary":
+        return isinstance(quantization_config, BinaryQuantization) and bool(quantization_config.binary.always_ram)
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+
+def _quantization_config(index_config):
+    if index_config["quantization"] is None:
+        return None
+    if index_config["quantization"] == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=index_config["quantile"], always_ram=True)
+        )
+    if index_config["quantization"] == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization: {index_config['quantization']}")
+
+
+def _init_payload_indexes(qdrant_client, collection_name, config_loader):
+    """Creates the payload indexes used to pre-filter the searches by metadata.
+
+    Qdrant builds them in the background (`wait=False`), so startup doesn't block on indexing a large collection.
+    """
+    logger = lg.getLogger(_init_payload_indexes.__name__)
+    payload_schema = qdrant_client.get_collection(collection_name=collection_name).payload_schema
+    for field_name, field_schema in config_loader["payload_indexes"].items():
+        if field_name not in payload_schema:
+            logger.info("Creating payload index [%s] in collection [%s]", field_name, collection_name)
+            qdrant_client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=PayloadSchemaType(field_schema),
+                wait=False,
+            )
+
+
+def _init_async_vector_store(config_loader, vector_store):
+    """Search backends used by the service instead of the LangChain vector stores (the ETLs keep using those).
+
+    Collections listed in `mmap_vector_store` are searched in-process, the rest with the native async Qdrant client
+    when `qdrant_async` is enabled.
+    """
+    mmap_collections = config_loader["mmap_vector_store"]["collections"]
+    if not config_loader["qdrant_async"]["enabled"] and not mmap_collections:
+        return None
+    logger = lg.getLogger(_init_async_vector_store.__name__)
+    logger.info("Initializing async vector stores")
+    async_vector_store = dict(vector_store)
+    if config_loader["qdrant_async"]["enabled"]:
+        from src.service.qdrant import init_async_qdrant_collections
+
+        async_vector_store.update(
+            init_async_qdrant_collections(
+                url=os.environ["QDRANT_API_URL"],
+                api_key=os.environ["QDRANT_API_KEY"],
+                collection_names=[name for name in config_loader["collections"] if name not in mmap_collections],
+                pool_size=config_loader["qdrant_async"]["pool_size"],
+                timeout_seconds=config_loader["qdrant_async"]["timeout_seconds"],
+                payload_fields=config_loader["qdrant_async"]["payload_fields"],
+            )
+        )
+    if mmap_collections:
+        from src.service.mmap_store import MmapVectorStore
+
+        for collection_name in mmap_collections:
+            async_vector_store[collection_name] = MmapVectorStore(
+                os.path.join(os.environ["APP_PATH"], config_loader["mmap_vector_store"]["dir"], collection_name),
+                nprobe=config_loader["mmap_vector_store"]["nprobe"],
+            )
+    logger.info("Initialized async vector stores")
+    return async_vector_store
+
+
 def _init_openai_client():
     logger = lg.getLogger(_init_openai_client.__name__)
     logger.info("Initializing OpenAI client")
@@ -103,6 +388,90 @@ def _init_openai_client():
     return client
 
 
+def _init_tavily_client(config_loader):
+    logger = lg.getLogger(_init_tavily_client.__name__)
+    logger.info("Initializing Tavily client")
+    client = AsyncTavilyClient(
+        api_key=os.environ["TAVILY_API_KEY"],
+        timeout_seconds=config_loader["tavily"]["timeout_seconds"],
+        max_connections=config_loader["tavily"]["max_connections"],
+        cache_max_size=config_loader["tavily"]["cache_max_size"],
+        cache_ttl_seconds=config_loader["tavily"]["cache_ttl_seconds"],
+        admission=AdmissionController("tavily", **config_loader["admission"]["tavily"]),
+    )
+    logger.info("Initialized Tavily client")
+    return client
+
+
+def _init_answer_cache(config_loader):
+    logger = lg.getLogger(_init_answer_cache.__name__)
+    logger.info("Initializing answer cache")
+    answer_cache = AnswerCache(
+        max_size=config_loader["answer_cache"]["max_size"],
+        ttl_seconds=config_loader["answer_cache"]["ttl_seconds"],
+        config_version=config_version(config_loader),
+    )
+    logger.info("Initialized answer cache with config version [%s]", answer_cache.config_version)
+    return answer_cache
+
+
+def _init_semantic_cache(config_loader):
+    logger = lg.getLogger(_init_semantic_cache.__name__)
+    logger.info("Initializing semantic cache")
+    semantic_cache = SemanticAnswerCache(
+        max_size=config_loader["semantic_cache"]["max_size"],
+        ttl_seconds=config_loader["semantic_cache"]["ttl_seconds"],
+        similarity_threshold=config_loader["semantic_cache"]["similarity_threshold"],
+        config_version=config_version(config_loader),
+        max_partitions=config_loader["semantic_cache"]["max_partitions"],
+    )
+    logger.info("Initialized semantic cache")
+    return semantic_cache
+
+
+def _init_completion_cache(config_loader):
+    if not config_loader["completion_cache"]["enabled"]:
+        return None
+    logger = lg.getLogger(_init_completion_cache.__name__)
+    logger.info("Initializing completion cache")
+    completion_cache = CompletionCache(
+        path=os.path.join(os.environ["APP_PATH"], config_loader["completion_cache"]["path"]),
+        max_size_bytes=config_loader["completion_cache"]["max_size_mb"] * 1024 * 1024,
+    )
+    logger.info("Initialized completion cache")
+    return completion_cache
+
+
+def _init_bm25_indexes(config_loader):
+    logger = lg.getLogger(_init_bm25_indexes.__name__)
+    logger.info("Initializing BM25 indexes")
+    bm25_indexes = BM25IndexStore(
+        indexes_dir=os.path.join(os.environ["APP_PATH"], config_loader["bm25"]["indexes_dir"]),
+        k1=config_loader["bm25"]["k1"],
+        b=config_loader["bm25"]["b"],
+        reload_interval_seconds=config_loader["bm25"]["reload_interval_seconds"],
+    )
+    if config_loader["bm25"]["enabled"]:
+        for collection_name in config_loader["collections"]:
+            bm25_indexes.load(collection_name)
+    logger.info("Initialized BM25 indexes")
+    return bm25_indexes
+
+
+def _init_reranker(config_loader):
+    if not config_loader["reranker"]["enabled"]:
+        return None
+    from src.service.rerank import CrossEncoderReranker
+
+    logger = lg.getLogger(_init_reranker.__name__)
+    logger.info("Initializing reranker")
+    reranker = CrossEncoderReranker(
+        model_name=config_loader["reranker"]["model_name"], max_length=config_loader["reranker"]["max_length"]
+    )
+    logger.info("Initialized reranker")
+    return reranker
+
+
 def _exists_collection(qdrant_client, collection_name):
     logger = lg.getLogger(_exists_collection.__name__)
     try:
@@ -115,6 +484,14 @@ def _exists_collection(qdrant_client, collection_name):
 
 def _init_retrieval_qa_llm(vector_store, config_loader):
     # DEPRECATED
+    from langchain.chains import RetrievalQA
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import (
+        ChatPromptTemplate,
+        HumanMessagePromptTemplate,
+        SystemMessagePromptTemplate,
+    )
+
     logger = lg.getLogger(_init_retrieval_qa_llm.__name__)
     logger.info("Initializing RetrievalQA LLM")
     retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": config_loader["top_k_results"]})
@@ -137,3 +514,13 @@ def _init_retrieval_qa_llm(vector_store, config_loader):
     logger.info(retrieval_qa.combine_documents_chain.llm_chain.prompt.format)
     logger.info("Initialized RetrievalQA LLM")
     return retrieval_qa
+
+
+if __name__ == "__main__":
+    import typer
+
+    app = typer.Typer()
+    # A callback keeps `migrate-collections` as a subcommand of the single-command app
+    app.callback()(lambda: None)
+    app.command()(migrate_collections)
+    app()
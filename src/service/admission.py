@@ -0,0 +1,67 @@
+import asyncio
+import contextlib
+import time
+
+from src.service.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT
+
+
+class AdmissionRejected(Exception):
+    """The call was not admitted: the wait queue is full or the wait exceeded `max_queue_seconds`"""
+
+    def __init__(self, name: str, reason: str, retry_after_seconds: int):
+        super().__init__(f"Too many concurrent calls to {name} ({reason}), retry after {retry_after_seconds}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+
+
+class AdmissionController:
+    """Bounds the concurrent calls to an upstream API (LLM, Tavily) with a bounded wait queue.
+
+    At most `max_concurrency` calls run at once and up to `max_queue_size` more wait for a slot, each for at most
+    `max_queue_seconds`. Calls beyond that are rejected at once with `AdmissionRejected`, instead of piling up
+    behind the provider rate limits.
+    """
+
+    def __init__(
+        self, name: str, max_concurrency: int, max_queue_size: int, max_queue_seconds: float, retry_after_seconds: int
+    ):
+        self.name = name
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_queue_size = max_queue_size
+        self._max_queue_seconds = max_queue_seconds
+        self._retry_after_seconds = retry_after_seconds
+        self.waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            await self._wait()
+        else:
+            await self._semaphore.acquire()
+            ADMISSION_WAIT.labels(controller=self.name).observe(0)
+        ADMISSION_IN_FLIGHT.labels(controller=self.name).inc()
+        try:
+            yield
+        finally:
+            ADMISSION_IN_FLIGHT.labels(controller=self.name).dec()
+            self._semaphore.release()
+
+    async def _wait(self):
+        if self.waiting >= self._max_queue_size:
+            self._reject("queue_full")
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.labels(controller=self.name).set(self.waiting)
+        start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._max_queue_seconds)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.labels(controller=self.name).set(self.waiting)
+            ADMISSION_WAIT.labels(controller=self.name).observe(time.perf_counter() - start_time)
+
+    def _reject(self, reason: str):
+        ADMISSION_REJECTED.labels(controller=self.name, reason=reason).inc()
+        raise AdmissionRejected(self.name, reason, self._retry_after_seconds)
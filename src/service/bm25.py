@@ -0,0 +1,270 @@
+import array
+import json
+import logging as lg
+import math
+import mmap
+import os
+import pickle
+import re
+import threading
+import time
+import typing as tp
+import unicodedata
+import uuid
+
+import numpy as np
+from langchain.schema import Document
+
+TOKEN_PATTERN = re.compile(r"\d+(?:[/.]\d+)+|\w+")
+STOPWORDS = frozenset(
+    "a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el "
+    "ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos fue ha hay la las "
+    "le les lo los mas me mi muy no nos o para pero por que se sea ser si sin sobre su sus tambien te "
+    "tiene u un una uno unos y ya".split()
+)
+MANIFEST_FILE = "segments.json"
+
+
+def tokenize(text: str) -> tp.List[str]:
+    """Lowercased tokens without accents or stopwords. Identifiers such as '10/2022' are kept as a single token."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+
+
+class BM25Segment:
+    """Immutable inverted index of a batch of chunks, written once by an ETL run.
+
+    Postings are compact typed arrays of document ids and term frequencies. The documents live in a JSON lines file
+    next to the index and are memory-mapped, so they are shared by the workers through the OS page cache and only
+    the hits are decoded.
+    """
+
+    def __init__(self):
+        self.postings: tp.Dict[str, tp.Tuple[array.array, array.array]] = {}
+        self.doc_lengths = array.array("I")
+        self.doc_offsets = array.array("q", [0])
+        self.total_length = 0
+        self._docs: tp.Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key != "_docs"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _docs=None)
+
+    @staticmethod
+    def build(docs: tp.Iterable[Document], path: str) -> "BM25Segment":
+        """Indexes the documents, writing them to `path`.jsonl and the index to `path`.pkl"""
+        segment = BM25Segment()
+        with open(f"{path}.jsonl", "wb") as f:
+            for doc in docs:
+                doc_id = len(segment)
+                tokens = tokenize(doc.page_content)
+                term_frequencies: tp.Dict[str, int] = {}
+                for token in tokens:
+                    term_frequencies[token] = term_frequencies.get(token, 0) + 1
+                for token, term_frequency in term_frequencies.items():
+                    doc_ids, frequencies = segment.postings.setdefault(token, (array.array("I"), array.array("H")))
+                    doc_ids.append(doc_id)
+                    frequencies.append(min(term_frequency, 65535))
+                segment.doc_lengths.append(len(tokens))
+                segment.total_length += len(tokens)
+                line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}).encode("utf-8")
+                f.write(line + b"\n")
+                segment.doc_offsets.append(segment.doc_offsets[-1] + len(line) + 1)
+        with open(f"{path}.pkl", "wb") as f:
+            pickle.dump(segment, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return segment
+
+    @staticmethod
+    def load(path: str) -> "BM25Segment":
+        with open(f"{path}.pkl", "rb") as f:
+            segment = pickle.load(f)
+        if len(segment):
+            with open(f"{path}.jsonl", "rb") as f:
+                segment._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return segment
+
+    def documents(self) -> tp.Iterator[Document]:
+        for doc_id in range(len(self)):
+            yield self.document(doc_id)
+
+    def document(self, doc_id: int) -> Document:
+        return Document(**json.loads(self._docs[self.doc_offsets[doc_id] : self.doc_offsets[doc_id + 1]]))
+
+    def score(
+        self, idfs: tp.Dict[str, float], avg_length: float, k1: float, b: float
+    ) -> tp.Tuple[np.ndarray, np.ndarray]:
+        """BM25 scores of the documents containing any query token, computed over their postings only
+
+        :return: document ids and their scores
+        """
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+        all_doc_ids = []
+        all_scores = []
+        for token, idf in idfs.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            doc_ids = np.frombuffer(posting[0], dtype=np.uint32)
+            frequencies = np.frombuffer(posting[1], dtype=np.uint16).astype(np.float32)
+            norms = k1 * (1 - b + b * doc_lengths[doc_ids] / avg_length)
+            all_doc_ids.append(doc_ids)
+            all_scores.append(idf * frequencies * (k1 + 1) / (frequencies + norms))
+        if not all_doc_ids:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.float32)
+        if len(all_doc_ids) == 1:
+            return all_doc_ids[0], all_scores[0]
+        doc_ids, inverse = np.unique(np.concatenate(all_doc_ids), return_inverse=True)
+        return doc_ids, np.bincount(inverse, weights=np.concatenate(all_scores))
+
+
+class BM25Index:
+    """Okapi BM25 over the segments of a collection, with the statistics (IDF, average length) of all of them"""
+
+    def __init__(self, segments: tp.List[BM25Segment], k1: float = 1.5, b: float = 0.75):
+        self.segments = segments
+        self.k1 = k1
+        self.b = b
+        self._n_docs = sum(len(segment) for segment in segments)
+        self._avg_length = sum(segment.total_length for segment in segments) / max(self._n_docs, 1)
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def search(self, query: str, k: int) -> tp.List[tp.Tuple[Document, float]]:
+        if not self._n_docs:
+            return []
+        idfs = {}
+        for token in set(tokenize(query)):
+            doc_frequency = sum(
+                len(segment.postings[token][0]) for segment in self.segments if token in segment.postings
+            )
+            if doc_frequency:
+                idfs[token] = math.log(1 + (self._n_docs - doc_frequency + 0.5) / (doc_frequency + 0.5))
+        hits = []
+        for segment in self.segments:
+            doc_ids, scores = segment.score(idfs, self._avg_length, self.k1, self.b)
+            if len(doc_ids) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                doc_ids, scores = doc_ids[top], scores[top]
+            hits += [(float(score), segment, int(doc_id)) for doc_id, score in zip(doc_ids, scores) if score > 0]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [(segment.document(doc_id), score) for score, segment, doc_id in hits[:k]]
+
+
+class BM25IndexStore:
+    """BM25 indexes of the collections, stored in `indexes_dir` and reloaded when the ETLs update them.
+
+    Each collection is a directory of segments listed in a manifest. The ETLs add a segment per run without reading
+    the existing ones, and merge them into one once there are more than `max_segments`. The service checks the
+    manifest every `reload_interval_seconds` in a background thread and only loads the new segments.
+    """
+
+    def __init__(self, indexes_dir: str, k1: float, b: float, reload_interval_seconds: float, max_segments: int = 32):
+        self._indexes_dir = indexes_dir
+        self._k1 = k1
+        self._b = b
+        self._reload_interval_seconds = reload_interval_seconds
+        self._max_segments = max_segments
+        self._indexes: tp.Dict[str, tp.Tuple[tp.Dict[str, BM25Segment], BM25Index]] = {}
+        self._checked_at: tp.Dict[str, float] = {}
+        self._reloading: tp.Set[str] = set()
+        self._lock = threading.Lock()
+
+    def path(self, collection_name: str) -> str:
+        return os.path.join(self._indexes_dir, collection_name)
+
+    def load(self, collection_name: str) -> tp.Optional[BM25Index]:
+        """Loads the index of the collection now (at startup)"""
+        self._checked_at[collection_name] = time.monotonic()
+        self._reload(collection_name)
+        return self.get(collection_name)
+
+    def get(self, collection_name: str) -> tp.Optional[BM25Index]:
+        """Index of the collection, or None if no ETL has built it yet. Never blocks on a reload."""
+        now = time.monotonic()
+        if now - self._checked_at.get(collection_name, -math.inf) >= self._reload_interval_seconds:
+            self._checked_at[collection_name] = now
+            with self._lock:
+                start_reload = collection_name not in self._reloading
+                self._reloading.add(collection_name)
+            if start_reload:
+                threading.Thread(target=self._background_reload, args=(collection_name,), daemon=True).start()
+        segments_index = self._indexes.get(collection_name)
+        return segments_index[1] if segments_index else None
+
+    def add_documents(self, collection_name: str, docs: tp.List[Document]) -> None:
+        """Adds the documents to the collection as a new segment (used by the ETLs)"""
+        logger = lg.getLogger(self.add_documents.__name__)
+        path = self.path(collection_name)
+        os.makedirs(path, exist_ok=True)
+        segment_names = self._read_manifest(path) or []
+        segment_name = self._new_segment_name()
+        segment = BM25Segment.build(docs, os.path.join(path, segment_name))
+        segment_names.append(segment_name)
+        self._write_manifest(path, segment_names)
+        logger.info("BM25 index [%s] updated with a segment of %s documents", collection_name, len(segment))
+        if len(segment_names) > self._max_segments:
+            self._merge_segments(collection_name, segment_names)
+
+    def _merge_segments(self, collection_name: str, segment_names: tp.List[str]) -> None:
+        logger = lg.getLogger(self._merge_segments.__name__)
+        path = self.path(collection_name)
+        segments = [BM25Segment.load(os.path.join(path, name)) for name in segment_names]
+        merged_name = self._new_segment_name()
+        merged = BM25Segment.build(
+            (doc for segment in segments for doc in segment.documents()), os.path.join(path, merged_name)
+        )
+        self._write_manifest(path, [merged_name])
+        for name in segment_names:
+            for extension in ("pkl", "jsonl"):
+                os.remove(os.path.join(path, f"{name}.{extension}"))
+        logger.info("BM25 index [%s] merged into one segment of %s documents", collection_name, len(merged))
+
+    def _background_reload(self, collection_name: str) -> None:
+        try:
+            self._reload(collection_name)
+        except Exception:
+            lg.getLogger(self._background_reload.__name__).exception("Error reloading BM25 index [%s]", collection_name)
+        finally:
+            with self._lock:
+                self._reloading.discard(collection_name)
+
+    def _reload(self, collection_name: str) -> None:
+        path = self.path(collection_name)
+        segment_names = self._read_manifest(path)
+        if segment_names is None:
+            return
+        loaded_segments = self._indexes.get(collection_name, ({}, None))[0]
+        if list(loaded_segments) == segment_names:
+            return
+        lg.getLogger(self._reload.__name__).info("Loading BM25 index [%s]", collection_name)
+        segments = {
+            name: loaded_segments.get(name) or BM25Segment.load(os.path.join(path, name)) for name in segment_names
+        }
+        self._indexes[collection_name] = (segments, BM25Index(list(segments.values()), k1=self._k1, b=self._b))
+
+    @staticmethod
+    def _new_segment_name() -> str:
+        return f"segment-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def _read_manifest(path: str) -> tp.Optional[tp.List[str]]:
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_manifest(path: str, segment_names: tp.List[str]) -> None:
+        """Atomically replaces the manifest, so readers never see a partial list"""
+        tmp_path = os.path.join(path, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(segment_names, f)
+        os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
@@ -0,0 +1,313 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing as tp
+import unicodedata
+
+import numpy as np
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries also expire after `ttl_seconds`."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._data: tp.OrderedDict[tp.Hashable, tp.Tuple[float, tp.Any]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tp.Hashable) -> tp.Optional[tp.Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: tp.Hashable, value: tp.Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return dict(size=len(self), hits=self.hits, misses=self.misses, hit_rate=self.hit_rate)
+
+
+class AnswerCache(TTLCache):
+    """Exact-match cache of `/qa` response payloads.
+
+    Keys are built from the normalized query, the collection, the model and the config version, so any change in
+    the prompts or generation parameters invalidates the previous answers.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, config_version: str):
+        super().__init__(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.config_version = config_version
+
+    def key(self, input_query: str, collection_name: str, model_name: str) -> tp.Tuple[str, str, str, str]:
+        return normalize_query(input_query), collection_name, model_name, self.config_version
+
+
+class _SemanticPartition:
+    """Matrix of unit query embeddings with their payloads, expiry times and last access times.
+
+    Only the first `size` slots are used. The arrays start small and double when full, up to `max_size` slots.
+    """
+
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, max_size: int, dim: int):
+        self.max_size = max_size
+        self.size = 0
+        capacity = min(self.INITIAL_CAPACITY, max_size)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires_at = np.full(capacity, -np.inf)
+        self.last_used = np.full(capacity, -np.inf)
+        self.values: tp.List[tp.Any] = [None] * capacity
+
+    def free_slot(self, now: float) -> int:
+        """Slot for a new entry: an expired one, a new one (growing the arrays) or the least recently used one"""
+        expired = np.flatnonzero(self.expires_at[: self.size] < now)
+        if expired.size:
+            return int(expired[0])
+        if self.size == len(self.values) and self.size < self.max_size:
+            self._grow(min(2 * self.size, self.max_size))
+        if self.size < len(self.values):
+            self.size += 1
+            return self.size - 1
+        return int(np.argmin(self.last_used))
+
+    def live_entries(self, now: float) -> int:
+        return int(np.count_nonzero(self.expires_at[: self.size] >= now))
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - len(self.values)
+        self.vectors = np.vstack([self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float32)])
+        self.expires_at = np.concatenate([self.expires_at, np.full(extra, -np.inf)])
+        self.last_used = np.concatenate([self.last_used, np.full(extra, -np.inf)])
+        self.values += [None] * extra
+
+
+class SemanticAnswerCache:
+    """Cache of `/qa` response payloads looked up by cosine similarity of the query embeddings.
+
+    Every partition (scope, model and config version) keeps its own matrix, so answers never leak between
+    collections. Inside a partition expired slots are reused first, then the least recently used one. At most
+    `max_partitions` partitions are kept: partitions whose entries all expired are dropped, then the least recently
+    used ones.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+        config_version: str,
+        max_partitions: int,
+    ):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._similarity_threshold = similarity_threshold
+        self.config_version = config_version
+        self._max_partitions = max_partitions
+        self._partitions: tp.OrderedDict[tp.Tuple[str, str, str], _SemanticPartition] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_embedding: tp.Sequence[float], collection_name: str, model_name: str) -> tp.Optional[tp.Any]:
+        vector = _unit_vector(query_embedding)
+        with self._lock:
+            key = self._partition_key(collection_name, model_name)
+            partition = self._partitions.get(key)
+            if partition is None or partition.size == 0:
+                self.misses += 1
+                return None
+            self._partitions.move_to_end(key)
+            now = time.monotonic()
+            similarities = partition.vectors[: partition.size] @ vector
+            similarities[partition.expires_at[: partition.size] < now] = -np.inf
+            index = int(np.argmax(similarities))
+            if similarities[index] < self._similarity_threshold:
+                self.misses += 1
+                return None
+            partition.last_used[index] = now
+            self.hits += 1
+            return partition.values[index]
+
+    def set(self, query_embedding: tp.Sequence[float], collection_name: str, model_name: str, value: tp.Any) -> None:
+        vector = _unit_vector(query_embedding)
+        with self._lock:
+            now = time.monotonic()
+            key = self._partition_key(collection_name, model_name)
+            partition = self._partitions.get(key)
+            if partition is None:
+                self._evict_partitions(now)
+                partition = self._partitions[key] = _SemanticPartition(self._max_size, vector.shape[0])
+            self._partitions.move_to_end(key)
+            index = partition.free_slot(now)
+            partition.vectors[index] = vector
+            partition.expires_at[index] = now + self._ttl_seconds
+            partition.last_used[index] = now
+            partition.values[index] = value
+
+    def _evict_partitions(self, now: float) -> None:
+        """Makes room for a new partition"""
+        for key in [key for key, partition in self._partitions.items() if not partition.live_entries(now)]:
+            del self._partitions[key]
+        while len(self._partitions) >= self._max_partitions:
+            self._partitions.popitem(last=False)
+
+    def __len__(self) -> int:
+        now = time.monotonic()
+        return sum(partition.live_entries(now) for partition in self._partitions.values())
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return dict(size=len(self), hits=self.hits, misses=self.misses, hit_rate=self.hit_rate)
+
+    def _partition_key(self, collection_name: str, model_name: str) -> tp.Tuple[str, str, str]:
+        return collection_name, model_name, self.config_version
+
+
+class CompletionCache:
+    """Persistent cache of LLM completions in a SQLite database (WAL mode), shared by the workers and restarts.
+
+    Keys are hashes of the full request (messages, model and generation parameters) and values the completions
+    serialized as JSON. When the stored completions exceed `max_size_bytes`, the least recently used ones are
+    evicted down to 90% of it.
+
+    The total size is tracked in memory from this process's inserts and only summed in the database every
+    `SIZE_CHECK_INTERVAL` inserts (to account for the other workers) or when the tracked size exceeds the limit.
+    """
+
+    SIZE_CHECK_INTERVAL = 256
+
+    def __init__(self, path: str, max_size_bytes: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._max_size_bytes = max_size_bytes
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+        self._lock = threading.Lock()
+        self._size_bytes = self._total_size()
+        self._inserts_since_size_check = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        messages: tp.List[tp.Dict[str, str]], model_name: str, temperature: float, seed: int, max_tokens: int
+    ) -> str:
+        content = json.dumps(
+            dict(messages=messages, model=model_name, temperature=temperature, seed=seed, max_tokens=max_tokens),
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tp.Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._size_bytes += size
+            self._inserts_since_size_check += 1
+            if self._size_bytes > self._max_size_bytes or self._inserts_since_size_check >= self.SIZE_CHECK_INTERVAL:
+                self._evict()
+
+    def _total_size(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def _evict(self) -> None:
+        total_size = self._total_size()
+        self._size_bytes = total_size
+        self._inserts_since_size_check = 0
+        if total_size <= self._max_size_bytes:
+            return
+        excess = total_size - int(self._max_size_bytes * 0.9)
+        evicted = 0
+        cutoff = None
+        rows = self._connection.execute("SELECT accessed_at, size FROM completions ORDER BY accessed_at")
+        for accessed_at, size in rows:
+            cutoff = accessed_at
+            evicted += size
+            if evicted >= excess:
+                break
+        self._connection.execute("DELETE FROM completions WHERE accessed_at <= ?", (cutoff,))
+        self._size_bytes = self._total_size()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> tp.Dict[str, tp.Any]:
+        return dict(size=len(self), hits=self.hits, misses=self.misses, hit_rate=self.hit_rate)
+
+
+def _unit_vector(embedding: tp.Sequence[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def normalize_query(input_query: str) -> str:
+    """Canonical form of a query: unicode NFC, lowercase and collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFC", input_query).lower().split())
+
+
+def config_version(config_loader: tp.Dict[str, tp.Any]) -> str:
+    """Short hash of the config entries that change the answer of the LLM"""
+    keys = ("embeddings_model_name", "top_k_results", "bm25", "reranker", "prompt_system", "prompt_system_context",
+            "context_max_tokens", "temperature", "seed", "max_tokens")
+    content = json.dumps({key: config_loader.get(key) for key in keys}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
@@ -0,0 +1,76 @@
+import functools
+import typing as tp
+
+import tiktoken
+
+MIN_OVERLAP_CHARS = 20
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    return len(_encoding(model_name).encode(text, disallowed_special=()))
+
+
+def _overlap(previous: str, current: str, max_overlap: int) -> int:
+    """Length of the longest suffix of `previous` that is also a prefix of `current`"""
+    for length in range(min(max_overlap, len(previous), len(current)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:length]):
+            return length
+    return 0
+
+
+def _remove_overlaps(text: str, packed_texts: tp.List[str], max_overlap: int) -> str:
+    """Trims the text shared with the chunks already packed (adjacent chunks of the same document)"""
+    for packed_text in packed_texts:
+        if not text:
+            break
+        if text in packed_text:
+            return ""
+        head = _overlap(packed_text, text, max_overlap)
+        if head:
+            text = text[head:]
+        tail = _overlap(text, packed_text, max_overlap)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+
+def pack_context(
+    chunks: tp.Iterable[tp.Tuple[str, float]],
+    max_tokens: int,
+    model_name: str,
+    max_overlap: int,
+) -> str:
+    """Packs the retrieved chunks in a compact plain-text layout for the LLM prompt.
+
+    Chunks are taken in order (best score first), duplicated and overlapping text with previous chunks is removed, and
+    packing stops when the next chunk does not fit in the token budget. The first chunk is always included.
+
+    :param chunks: (text, score) pairs sorted by relevance
+    :param max_tokens: token budget of the packed context
+    :param model_name: LLM model used to count the tokens
+    :param max_overlap: maximum number of characters shared by adjacent chunks
+    :return: one block per chunk with the format "[n] (score: 0.83)\ntext"
+    """
+    packed_texts = []
+    blocks = []
+    used_tokens = 0
+    for text, score in chunks:
+        text = _remove_overlaps(text.strip(), packed_texts, max_overlap)
+        if not text:
+            continue
+        block = f"[{len(blocks) + 1}] (score: {score:.2f})\n{text}"
+        block_tokens = count_tokens(block, model_name)
+        if blocks and used_tokens + block_tokens > max_tokens:
+            break
+        packed_texts.append(text)
+        blocks.append(block)
+        used_tokens += block_tokens
+    return "\n\n".join(blocks)
@@ -0,0 +1,72 @@
+import asyncio
+import time
+import typing as tp
+
+from starlette.requests import Request
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str, timeout_seconds: float):
+        super().__init__(f"Deadline exceeded in stage {stage} ({timeout_seconds:.2f}s left for it)")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class Deadline:
+    """End-to-end deadline of a request, split across its stages.
+
+    Each stage gets the time left minus the shares of the total reserved for the stages after it, so the time a
+    stage does not use passes to the next ones, and a slow stage cannot eat the budget of the later stages.
+    """
+
+    def __init__(self, total_seconds: float, stage_shares: tp.Dict[str, float]):
+        self._expires_at = time.monotonic() + total_seconds
+        self._stages = list(stage_shares)
+        self._reserved = {stage: share * total_seconds for stage, share in stage_shares.items()}
+
+    def remaining(self) -> float:
+        return self._expires_at - time.monotonic()
+
+    def timeout(self, stage: str) -> float:
+        later_stages = self._stages[self._stages.index(stage) + 1 :]
+        return max(0.0, self.remaining() - sum(self._reserved[later_stage] for later_stage in later_stages))
+
+    async def run(self, stage: str, awaitable: tp.Awaitable[tp.Any]) -> tp.Any:
+        """Awaits the stage, cancelling it when its time is up.
+
+        Only the deadline itself raises `DeadlineExceeded`: timeouts raised inside the stage (e.g. by a client with its
+        own timeout) propagate as they are.
+        """
+        timeout_seconds = self.timeout(stage)
+        task = asyncio.ensure_future(awaitable)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout_seconds)
+        finally:
+            if not task.done():
+                task.cancel()
+        if not done:
+            raise DeadlineExceeded(stage, timeout_seconds)
+        return task.result()
+
+
+async def cancel_on_disconnect(
+    request: Request, awaitable: tp.Awaitable[tp.Any], poll_interval_seconds: float
+) -> tp.Any:
+    """Awaits the work of a request, cancelling it if the client disconnects meanwhile.
+
+    :raise ClientDisconnected: if the client went away before the work finished
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval_seconds)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,100 @@
+import asyncio
+import concurrent.futures
+import logging as lg
+import typing as tp
+
+from langchain_core.embeddings import Embeddings
+
+from src.service.cache import TTLCache
+
+
+class BatchingEmbeddingExecutor:
+    """Groups the queries of concurrent requests into a single `embed_documents` call.
+
+    A batch is closed when it reaches `max_batch_size` queries or `max_wait_ms` milliseconds after its first query
+    arrived. The forward pass runs in a dedicated thread so the event loop stays free.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int, max_wait_ms: float):
+        self._embeddings = embeddings
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="embeddings")
+        self._queue: tp.Optional[asyncio.Queue] = None
+        self._worker: tp.Optional[asyncio.Task] = None
+
+    async def embed_query(self, text: str) -> tp.List[float]:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self) -> None:
+        logger = lg.getLogger(self._run.__name__)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Queries of cancelled requests are not embedded
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            logger.info("Embedding batch of %s queries (%s unique)", len(batch), len(texts))
+            try:
+                embeddings = await loop.run_in_executor(self._thread_pool, self._embeddings.embed_documents, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            embeddings_by_text = dict(zip(texts, embeddings))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(embeddings_by_text[text])
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a bounded LRU cache of query embeddings keyed on the exact query string.
+
+    Cache misses in the async path go through the batching executor when one is given. Document embeddings (used by
+    the ETLs) are not cached and go straight to the wrapped model.
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, max_size: int, batch_executor: tp.Optional[BatchingEmbeddingExecutor] = None
+    ):
+        self.embeddings = embeddings
+        self.cache = TTLCache(max_size=max_size, ttl_seconds=float("inf"))
+        self.batch_executor = batch_executor
+
+    def embed_documents(self, texts: tp.List[str]) -> tp.List[tp.List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> tp.List[float]:
+        embedding = self.cache.get(text)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self.cache.set(text, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> tp.List[float]:
+        embedding = self.cache.get(text)
+        if embedding is None:
+            if self.batch_executor is not None:
+                embedding = await self.batch_executor.embed_query(text)
+            else:
+                embedding = await self.embeddings.aembed_query(text)
+            self.cache.set(text, embedding)
+        lg.getLogger(self.aembed_query.__name__).info("Query embeddings cache %s", self.cache.stats())
+        return embedding
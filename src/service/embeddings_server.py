@@ -0,0 +1,128 @@
+"""Embeddings server shared by all the uvicorn workers of a host.
+
+The model is loaded once in this process and the workers send their queries through a Unix socket, where queries
+from every worker are batched together. Run it with `python -m src.service.embeddings_server` and enable
+`embeddings_server` in the config.
+
+Protocol: every message is a 4-byte big-endian length followed by a JSON body. Requests are `{"texts": [...]}` and
+responses `{"embeddings": [...]}` or `{"error": "..."}`.
+"""
+import asyncio
+import json
+import logging as lg
+import os
+import socket
+import struct
+import typing as tp
+
+from langchain_core.embeddings import Embeddings
+
+from src.service.embeddings import BatchingEmbeddingExecutor
+
+HEADER = struct.Struct(">I")
+
+
+def _encode_message(message: tp.Dict[str, tp.Any]) -> bytes:
+    body = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+async def _read_message(reader: asyncio.StreamReader) -> tp.Dict[str, tp.Any]:
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Embeddings server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the embeddings server listening on `socket_path`"""
+
+    def __init__(self, socket_path: str, timeout_seconds: float):
+        self._socket_path = socket_path
+        self._timeout_seconds = timeout_seconds
+
+    def embed_documents(self, texts: tp.List[str]) -> tp.List[tp.List[float]]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self._timeout_seconds)
+            sock.connect(self._socket_path)
+            sock.sendall(_encode_message({"texts": texts}))
+            (length,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+            return self._embeddings(json.loads(_recv_exactly(sock, length)))
+
+    def embed_query(self, text: str) -> tp.List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: tp.List[str]) -> tp.List[tp.List[float]]:
+        async def request():
+            reader, writer = await asyncio.open_unix_connection(self._socket_path)
+            try:
+                writer.write(_encode_message({"texts": texts}))
+                await writer.drain()
+                return self._embeddings(await _read_message(reader))
+            finally:
+                writer.close()
+
+        return await asyncio.wait_for(request(), self._timeout_seconds)
+
+    async def aembed_query(self, text: str) -> tp.List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    @staticmethod
+    def _embeddings(response: tp.Dict[str, tp.Any]) -> tp.List[tp.List[float]]:
+        if "error" in response:
+            raise RuntimeError(f"Embeddings server error: {response['error']}")
+        return response["embeddings"]
+
+
+async def serve(embeddings: Embeddings, socket_path: str, max_batch_size: int, max_wait_ms: float) -> None:
+    logger = lg.getLogger(serve.__name__)
+    batch_executor = BatchingEmbeddingExecutor(embeddings, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_message(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    vectors = await asyncio.gather(*(batch_executor.embed_query(text) for text in request["texts"]))
+                    response = {"embeddings": vectors}
+                except Exception as e:
+                    logger.exception("Error embedding texts")
+                    response = {"error": str(e)}
+                writer.write(_encode_message(response))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    logger.info("Embeddings server listening on [%s]", socket_path)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    from src.initialize import _init_config, _init_embeddings_model, initialize_logging
+
+    initialize_logging()
+    config_loader = _init_config()
+    asyncio.run(
+        serve(
+            _init_embeddings_model(config_loader, {}),
+            socket_path=config_loader["embeddings_server"]["socket_path"],
+            max_batch_size=config_loader["embeddings_batching"]["max_batch_size"],
+            max_wait_ms=config_loader["embeddings_batching"]["max_wait_ms"],
+        )
+    )
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging as lg
 import time
 import uuid
@@ -7,10 +8,39 @@ import typing as tp
 import ipaddress
 
 import httpx
-from fastapi import FastAPI
-
-from src.initialize import initialize_app, initialize_logging
-from src.utils import inject_additional_attributes, timeit
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from openai.types.chat import ChatCompletion
+
+from src.initialize import initialize_logging, initialize_service
+from src.service.admission import AdmissionController, AdmissionRejected
+from src.service.context import pack_context
+from src.service.deadline import ClientDisconnected, Deadline, DeadlineExceeded, cancel_on_disconnect
+from src.service.metrics import (
+    RATE_LIMITED,
+    mark_process_dead,
+    record_cache_stats,
+    record_llm_usage,
+    register_caches,
+    render_metrics,
+    stage_timer,
+    track_request,
+)
+from src.service.rate_limit import TokenBucketRateLimiter, retry_after
+from src.service.retrieval import (
+    batch_search_collections,
+    build_filter,
+    build_search_params,
+    collection_index_config,
+    filter_key,
+    parse_collection_names,
+    reciprocal_rank_fusion,
+    search_collections,
+)
+from src.service.serialization import gzip_response, lean_docs, lean_qa_payload
+from src.service.singleflight import SingleFlight
+from src.utils import QABatchRequestModel, inject_additional_attributes, timeit
 from langtrace_python_sdk import SendUserFeedback, langtrace
 from langtrace_python_sdk.utils.with_root_span import with_langtrace_root_span
 
@@ -19,27 +49,294 @@ initialize_logging()
 
 APP = FastAPI()
 
-INIT_OBJECTS = initialize_app()
+INIT_OBJECTS = initialize_service()
 
 DEFAULT_INPUT_QUERY = (
     "¿Es de aplicación la ley de garantía integral de la libertad sexual a niños (varones) menores de edad "
     "víctimas de violencias sexuales o solo a niñas y mujeres?"
 )
 DEFAULT_COLLECTION_NAME = "justicio"
+QA_SINGLE_FLIGHT = SingleFlight()
+SEARCH_PARAMS = {
+    collection_name: build_search_params(collection_index_config(INIT_OBJECTS.config_loader, collection_name))
+    for collection_name in INIT_OBJECTS.config_loader["collections"]
+}
+LLM_ADMISSION = AdmissionController("llm", **INIT_OBJECTS.config_loader["admission"]["llm"])
+RATE_LIMITERS = {
+    limit: TokenBucketRateLimiter(
+        rate_per_second=INIT_OBJECTS.config_loader["rate_limit"][limit]["rate_per_second"],
+        burst=INIT_OBJECTS.config_loader["rate_limit"][limit]["burst"],
+        max_clients=INIT_OBJECTS.config_loader["rate_limit"]["max_clients"],
+        idle_seconds=INIT_OBJECTS.config_loader["rate_limit"]["idle_seconds"],
+    )
+    for limit in ("cheap", "expensive")
+    if INIT_OBJECTS.config_loader["rate_limit"]["enabled"]
+}
+register_caches(
+    {
+        "answer": INIT_OBJECTS.answer_cache,
+        "semantic": INIT_OBJECTS.semantic_cache,
+        "embeddings": INIT_OBJECTS.vector_store[DEFAULT_COLLECTION_NAME].embeddings.cache,
+        "tavily": INIT_OBJECTS.tavily_client.cache,
+        **({"completion": INIT_OBJECTS.completion_cache} if INIT_OBJECTS.completion_cache is not None else {}),
+    }
+)
+APP.add_event_handler("shutdown", mark_process_dead)
+
+
+@APP.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+
+@APP.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@APP.exception_handler(asyncio.TimeoutError)
+async def timeout_handler(request: Request, exc: asyncio.TimeoutError):
+    # Timeouts of the upstream clients inside a stage (e.g. `qdrant_async.timeout_seconds`), before the deadline
+    lg.getLogger(timeout_handler.__name__).warning("Upstream timeout in request %s", request.url)
+    return JSONResponse(status_code=504, content={"detail": "Upstream service timed out"})
+
+
+@APP.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    lg.getLogger(client_disconnected_handler.__name__).info("Client disconnected, request %s cancelled", request.url)
+    # Nobody reads it: 499 is the nginx convention for requests closed by the client
+    return Response(status_code=499)
 
 
 @with_langtrace_root_span()
 async def call_llm_api(span_id, trace_id, model_name: str, messages: tp.List[tp.Dict[str, str]]):
-    response = await INIT_OBJECTS.openai_client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-        temperature=INIT_OBJECTS.config_loader["temperature"],
-        seed=INIT_OBJECTS.config_loader["seed"],
-        max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
-    )
+    completion_cache = INIT_OBJECTS.completion_cache
+    if completion_cache is not None:
+        completion_key = completion_cache.key(
+            messages,
+            model_name,
+            temperature=INIT_OBJECTS.config_loader["temperature"],
+            seed=INIT_OBJECTS.config_loader["seed"],
+            max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
+        )
+        cached_completion = await asyncio.to_thread(completion_cache.get, completion_key)
+        if cached_completion is not None:
+            return ChatCompletion.model_validate_json(cached_completion), span_id, trace_id
+    async with LLM_ADMISSION.slot():
+        response = await INIT_OBJECTS.openai_client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=INIT_OBJECTS.config_loader["temperature"],
+            seed=INIT_OBJECTS.config_loader["seed"],
+            max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
+        )
+    record_llm_usage(model_name, response.usage)
+    if completion_cache is not None:
+        await asyncio.to_thread(completion_cache.set, completion_key, response.model_dump_json())
     return response, span_id, trace_id
 
 
+@with_langtrace_root_span()
+async def call_llm_api_stream(
+    span_id, trace_id, model_name: str, messages: tp.List[tp.Dict[str, str]], on_chunk: tp.Callable[[tp.Any], None]
+):
+    """Streams a completion, passing every chunk to `on_chunk`.
+
+    The stream is consumed here so the LLM call stays within its trace span and its admission slot.
+    """
+    async with LLM_ADMISSION.slot():
+        stream = await INIT_OBJECTS.openai_client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=INIT_OBJECTS.config_loader["temperature"],
+            seed=INIT_OBJECTS.config_loader["seed"],
+            max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            on_chunk(chunk)
+    return span_id, trace_id
+
+
+def _qa_messages(
+    input_query: str, chunks: tp.Iterable[tp.Tuple[str, float]], model_name: str
+) -> tp.List[tp.Dict[str, str]]:
+    context = pack_context(
+        chunks,
+        max_tokens=INIT_OBJECTS.config_loader["context_max_tokens"],
+        model_name=model_name,
+        max_overlap=INIT_OBJECTS.config_loader["chunk_overlap"],
+    )
+    return [
+        {"role": "system", "content": INIT_OBJECTS.config_loader["prompt_system"]},
+        {
+            "role": "system",
+            "content": INIT_OBJECTS.config_loader["prompt_system_context"],
+        },
+        {"role": "system", "content": "A continuación se proporciona el contexto:"},
+        {"role": "system", "content": context},
+        {
+            "role": "system",
+            "content": "A continuación se proporciona la pregunta del usuario:",
+        },
+        {"role": "user", "content": input_query},
+    ]
+
+
+def _check_rate_limit(limit: str, client: str, cost: float = 1) -> None:
+    """Raises a 429 with Retry-After when the client ran out of tokens for the `limit` endpoints"""
+    limiter = RATE_LIMITERS.get(limit)
+    if limiter is None:
+        return
+    wait_seconds = limiter.acquire(client, cost)
+    if wait_seconds:
+        RATE_LIMITED.labels(limit=limit).inc()
+        raise HTTPException(
+            status_code=429, detail="Too many requests", headers={"Retry-After": retry_after(wait_seconds)}
+        )
+
+
+def _client_key(request: Request, ip_request_client: ipaddress.IPv4Address | None) -> str:
+    """The client IP sent by the frontend, or the address of the connection"""
+    if ip_request_client is not None:
+        return str(ip_request_client)
+    return request.client.host if request.client else "unknown"
+
+
+async def _rate_limit_cheap(request: Request, ip_request_client: ipaddress.IPv4Address | None = None):
+    _check_rate_limit("cheap", _client_key(request, ip_request_client))
+
+
+async def _rate_limit_expensive(request: Request, ip_request_client: ipaddress.IPv4Address | None = None):
+    _check_rate_limit("expensive", _client_key(request, ip_request_client))
+
+
+def _collection_names(collection_name: str) -> tp.List[str]:
+    try:
+        return parse_collection_names(collection_name, INIT_OBJECTS.config_loader["collections"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _retrieval_k() -> int:
+    """Number of candidates retrieved: a wider set when they are reranked afterwards"""
+    if INIT_OBJECTS.reranker is not None:
+        return INIT_OBJECTS.config_loader["reranker"]["candidates_k"]
+    return INIT_OBJECTS.config_loader["top_k_results"]
+
+
+def _metadata_filters(
+    year: tp.List[str] | None = Query(None),
+    rango: tp.List[str] | None = Query(None),
+    departamento: tp.List[str] | None = Query(None),
+    source_name: tp.List[str] | None = Query(None),
+) -> tp.Dict[str, tp.List[str] | None]:
+    """Optional metadata filters of the search endpoints. Each one can be repeated to match any of its values."""
+    return {"anio": year, "rango": rango, "departamento": departamento, "source_name": source_name}
+
+
+def _cache_scope(collection_names: tp.List[str], metadata_filters: tp.Dict[str, tp.List[str] | None]) -> str:
+    """Collections and filters of a request: answers are only reused within the same scope.
+
+    The scope is canonical (sorted collections and filters), and the semantic cache keeps at most `max_partitions`
+    scopes, so arbitrary filter values can't grow it without bound.
+    """
+    scope = ",".join(sorted(collection_names))
+    metadata_filter_key = filter_key(metadata_filters)
+    return f"{scope}|{metadata_filter_key}" if metadata_filter_key else scope
+
+
+async def _search(
+    collection_names: tp.List[str],
+    query_embedding: tp.List[float],
+    input_query: str,
+    metadata_filters: tp.Dict[str, tp.List[str] | None],
+):
+    docs = await search_collections(
+        INIT_OBJECTS.async_vector_store or INIT_OBJECTS.vector_store,
+        collection_names,
+        query_embedding,
+        k=_retrieval_k(),
+        higher_is_better=INIT_OBJECTS.config_loader["distance_type"] != "Euclid",
+        query_filter=build_filter(metadata_filters),
+        search_params=SEARCH_PARAMS,
+    )
+    return (await _postprocess_hits(collection_names, [input_query], [docs], metadata_filters))[0]
+
+
+async def _postprocess_hits(
+    collection_names: tp.List[str],
+    input_queries: tp.List[str],
+    docs_by_query,
+    metadata_filters: tp.Dict[str, tp.List[str] | None],
+):
+    """Hybrid fusion and reranking of the hits of each query. The queries of a batch are reranked together."""
+    docs_by_query = await asyncio.gather(
+        *(
+            _fuse_lexical(collection_names, input_query, docs, metadata_filters)
+            for input_query, docs in zip(input_queries, docs_by_query)
+        )
+    )
+    if INIT_OBJECTS.reranker is not None:
+        with stage_timer("retrieval", "rerank"):
+            docs_by_query = await INIT_OBJECTS.reranker.rerank_batch(
+                input_queries,
+                docs_by_query,
+                top_n=INIT_OBJECTS.config_loader["reranker"]["top_n"],
+                timeout_ms=INIT_OBJECTS.config_loader["reranker"]["timeout_ms"],
+            )
+    return docs_by_query
+
+
+async def _fuse_lexical(
+    collection_names: tp.List[str], input_query: str, docs, metadata_filters: tp.Dict[str, tp.List[str] | None]
+):
+    """Fuses the dense hits with the BM25 hits of the collections (hybrid retrieval) when BM25 is enabled.
+
+    The BM25 searches run in worker threads, so the event loop keeps serving (and /qa/batch searches concurrently).
+    """
+    if not INIT_OBJECTS.config_loader["bm25"]["enabled"]:
+        return docs
+    k = _retrieval_k()
+    bm25_indexes = [INIT_OBJECTS.bm25_indexes.get(collection_name) for collection_name in collection_names]
+    hits = await asyncio.gather(
+        *[asyncio.to_thread(bm25_index.search, input_query, k) for bm25_index in bm25_indexes if bm25_index is not None]
+    )
+    lexical_docs = [
+        (doc, score)
+        for collection_hits in hits
+        for doc, score in collection_hits
+        if all(doc.metadata.get(field) in values for field, values in metadata_filters.items() if values)
+    ]
+    if not lexical_docs:
+        return docs
+    lexical_docs.sort(key=lambda doc: doc[1], reverse=True)
+    return reciprocal_rank_fusion([docs, lexical_docs], k=k, rrf_k=INIT_OBJECTS.config_loader["bm25"]["rrf_k"])
+
+
+def _serialize(endpoint: str, payload: tp.Any) -> JSONResponse:
+    with stage_timer(endpoint, "serialization"):
+        return JSONResponse(jsonable_encoder(payload))
+
+
+def _serialize_lean(endpoint: str, payload: tp.Any, request: Request) -> ORJSONResponse:
+    with stage_timer(endpoint, "serialization"):
+        return gzip_response(
+            ORJSONResponse(payload),
+            accept_encoding=request.headers.get("accept-encoding", ""),
+            minimum_size=INIT_OBJECTS.config_loader["lean_response"]["gzip_minimum_size"],
+        )
+
+
+def _sse_event(event: str, data: tp.Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
 @APP.get("/healthcheck")
 @timeit
 async def healthcheck():
@@ -48,24 +345,50 @@ async def healthcheck():
     return {"status": "OK"}
 
 
-@APP.get("/semantic_search")
+@APP.get("/metrics")
+async def metrics():
+    """Metrics in the Prometheus text format, aggregated over the workers when `PROMETHEUS_MULTIPROC_DIR` is set"""
+    record_cache_stats()
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+
+@APP.get("/semantic_search", dependencies=[Depends(_rate_limit_cheap)])
 @timeit
-async def semantic_search(input_query: str = DEFAULT_INPUT_QUERY, collection_name: str = DEFAULT_COLLECTION_NAME):
+@track_request
+async def semantic_search(
+    request: Request,
+    input_query: str = DEFAULT_INPUT_QUERY,
+    collection_name: str = DEFAULT_COLLECTION_NAME,
+    lean: bool = False,
+    metadata_filters: tp.Dict[str, tp.List[str] | None] = Depends(_metadata_filters),
+):
+    """`collection_name` accepts a collection, comma-separated collections or 'all' to search them concurrently.
+
+    With `lean` only the metadata fields listed in `lean_response.metadata_fields` are returned, encoded with orjson
+    and gzipped when the client accepts it.
+    """
     logger = lg.getLogger(semantic_search.__name__)
     logger.info(input_query)
-    docs = await INIT_OBJECTS.vector_store[collection_name].asimilarity_search_with_score(
-        query=input_query, k=INIT_OBJECTS.config_loader["top_k_results"]
-    )
+    collection_names = _collection_names(collection_name)
+    embeddings = INIT_OBJECTS.vector_store[collection_names[0]].embeddings
+    with stage_timer("semantic_search", "embedding"):
+        query_embedding = await embeddings.aembed_query(input_query)
+    with stage_timer("semantic_search", "search"):
+        docs = await _search(collection_names, query_embedding, input_query, metadata_filters)
     logger.info(docs)
-    return docs
+    if lean:
+        metadata_fields = INIT_OBJECTS.config_loader["lean_response"]["metadata_fields"]
+        return _serialize_lean("semantic_search", lean_docs(docs, metadata_fields), request)
+    return _serialize("semantic_search", docs)
 
 
-@APP.get("/semantic_search_tavily")
+@APP.get("/semantic_search_tavily", dependencies=[Depends(_rate_limit_expensive)])
 @timeit
 async def semantic_search_tavily(input_query: str = DEFAULT_INPUT_QUERY):
     logger = lg.getLogger(semantic_search_tavily.__name__)
     logger.info(input_query)
-    docs = INIT_OBJECTS.tavily_client.search(
+    docs = await INIT_OBJECTS.tavily_client.search(
         query=input_query,
         search_depth="advanced",
         include_domains=["https://www.boe.es/"],
@@ -96,49 +419,106 @@ async def qa_feedback(span_id: str, trace_id: str, user_score: int):
     return {"feedback": "OK"}
 
 
-@APP.get("/qa")
+@APP.get("/qa", dependencies=[Depends(_rate_limit_expensive)])
 @with_langtrace_root_span("RAG Justicio")
 @timeit
+@track_request
 async def qa(
+    request: Request,
     input_query: str = DEFAULT_INPUT_QUERY,
     collection_name: str = DEFAULT_COLLECTION_NAME,
     model_name: str = INIT_OBJECTS.config_loader["llm_model_name"],
     input_original_query: str | None = None,
     ip_request_client: ipaddress.IPv4Address | None = None,
+    lean: bool = False,
+    metadata_filters: tp.Dict[str, tp.List[str] | None] = Depends(_metadata_filters),
 ):
     logger = lg.getLogger(qa.__name__)
     logger.info(input_query)
+    collection_names = _collection_names(collection_name)
+
+    # Serving repeated questions from the answer cache
+    cache_key = INIT_OBJECTS.answer_cache.key(input_query, _cache_scope(collection_names, metadata_filters), model_name)
+    cached_payload = INIT_OBJECTS.answer_cache.get(cache_key)
+    if cached_payload is not None:
+        logger.info("Answer cache hit %s", INIT_OBJECTS.answer_cache.stats())
+        response_payload = cached_payload
+    else:
+        # Identical requests in flight share the same work, cancelled when all their clients are gone
+        deadline = Deadline(
+            INIT_OBJECTS.config_loader["qa_deadline"]["total_seconds"],
+            INIT_OBJECTS.config_loader["qa_deadline"]["stages"],
+        )
+        response_payload = await cancel_on_disconnect(
+            request,
+            QA_SINGLE_FLIGHT.do(
+                cache_key,
+                lambda: _qa(
+                    input_query,
+                    collection_names,
+                    model_name,
+                    metadata_filters,
+                    cache_key,
+                    input_original_query,
+                    ip_request_client,
+                    deadline,
+                ),
+            ),
+            poll_interval_seconds=INIT_OBJECTS.config_loader["qa_deadline"]["disconnect_poll_seconds"],
+        )
+    response_payload = dict(response_payload, scoring_id=str(uuid.uuid4()))
+    if lean:
+        metadata_fields = INIT_OBJECTS.config_loader["lean_response"]["metadata_fields"]
+        return _serialize_lean("qa", lean_qa_payload(response_payload, metadata_fields), request)
+    return _serialize("qa", response_payload)
+
+
+async def _qa(
+    input_query: str,
+    collection_names: tp.List[str],
+    model_name: str,
+    metadata_filters: tp.Dict[str, tp.List[str] | None],
+    cache_key: tp.Hashable,
+    input_original_query: str | None,
+    ip_request_client: ipaddress.IPv4Address | None,
+    deadline: Deadline,
+):
+    logger = lg.getLogger(_qa.__name__)
+    collection_name = ",".join(collection_names)
+    cache_scope = _cache_scope(collection_names, metadata_filters)
+
+    # Serving paraphrased questions from the semantic cache
+    embeddings = INIT_OBJECTS.vector_store[collection_names[0]].embeddings
+    with stage_timer("qa", "embedding"):
+        query_embedding = await deadline.run("embedding", embeddings.aembed_query(input_query))
+    cached_payload = INIT_OBJECTS.semantic_cache.get(query_embedding, cache_scope, model_name)
+    if cached_payload is not None:
+        logger.info("Semantic cache hit %s", INIT_OBJECTS.semantic_cache.stats())
+        INIT_OBJECTS.answer_cache.set(cache_key, cached_payload)
+        return cached_payload
 
     # Getting context from embedding database (Qdrant)
-    docs = await INIT_OBJECTS.vector_store[collection_name].asimilarity_search_with_score(
-        query=input_query, k=INIT_OBJECTS.config_loader["top_k_results"]
-    )
+    with stage_timer("qa", "search"):
+        docs = await deadline.run(
+            "retrieval", _search(collection_names, query_embedding, input_query, metadata_filters)
+        )
 
     # Generate response using a LLM (OpenAI)
-    context_preprocessed = [{"context": doc[0].page_content, "score": doc[1]} for doc in docs]
-    messages = [
-        {"role": "system", "content": INIT_OBJECTS.config_loader["prompt_system"]},
-        {
-            "role": "system",
-            "content": INIT_OBJECTS.config_loader["prompt_system_context"],
-        },
-        {"role": "system", "content": "A continuación se proporciona el contexto:"},
-        {"role": "system", "content": str(context_preprocessed)},
-        {
-            "role": "system",
-            "content": "A continuación se proporciona la pregunta del usuario:",
-        },
-        {"role": "user", "content": input_query},
-    ]
+    with stage_timer("qa", "prompt"):
+        messages = _qa_messages(input_query, [(doc.page_content, score) for doc, score in docs], model_name)
     # logger.info(messages)
     additional_attributes = {
         "db.collection.name": collection_name,
         "service.ip": ip_request_client,
         "llm.original_query": input_original_query
     }
-    response, span_id, trace_id = await inject_additional_attributes(
-        lambda: call_llm_api(model_name=model_name, messages=messages), additional_attributes
-    )
+    with stage_timer("qa", "llm"):
+        response, span_id, trace_id = await deadline.run(
+            "llm",
+            inject_additional_attributes(
+                lambda: call_llm_api(model_name=model_name, messages=messages), additional_attributes
+            ),
+        )
     answer = response.choices[0].message.content
     logger.info(answer)
     logger.info(response.usage)
@@ -150,17 +530,207 @@ async def qa(
         span_id=str(span_id),
         trace_id=str(trace_id),
     )
+    INIT_OBJECTS.answer_cache.set(cache_key, response_payload)
+    INIT_OBJECTS.semantic_cache.set(query_embedding, cache_scope, model_name, response_payload)
     return response_payload
 
 
-@APP.get("/qa_tavily")
+@APP.post("/qa/batch")
 @timeit
+@track_request
+async def qa_batch(request: QABatchRequestModel, http_request: Request):
+    """Answers many questions in one call.
+
+    The queries are embedded in a single forward pass and searched with one Qdrant batch request per collection,
+    then the LLM calls run concurrently (up to `qa_batch.max_concurrency`). Results are streamed as JSON lines in
+    completion order; each line carries the `index` of its query in the request.
+    """
+    logger = lg.getLogger(qa_batch.__name__)
+    logger.info("Batch of %s queries", len(request.queries))
+    if len(request.queries) > INIT_OBJECTS.config_loader["qa_batch"]["max_queries"]:
+        raise HTTPException(
+            status_code=400, detail=f"At most {INIT_OBJECTS.config_loader['qa_batch']['max_queries']} queries allowed"
+        )
+    _check_rate_limit("expensive", _client_key(http_request, None), cost=len(request.queries))
+    collection_names = _collection_names(request.collection_name)
+    metadata_filters = _metadata_filters(
+        year=request.year, rango=request.rango, departamento=request.departamento, source_name=request.source_name
+    )
+    cache_scope = _cache_scope(collection_names, metadata_filters)
+    model_name = request.model_name or INIT_OBJECTS.config_loader["llm_model_name"]
+
+    embeddings = INIT_OBJECTS.vector_store[collection_names[0]].embeddings
+    with stage_timer("qa_batch", "embedding"):
+        query_embeddings = await embeddings.aembed_documents(request.queries)
+    with stage_timer("qa_batch", "search"):
+        docs_by_query = await batch_search_collections(
+            INIT_OBJECTS.async_vector_store or INIT_OBJECTS.vector_store,
+            collection_names,
+            query_embeddings,
+            k=_retrieval_k(),
+            higher_is_better=INIT_OBJECTS.config_loader["distance_type"] != "Euclid",
+            query_filter=build_filter(metadata_filters),
+            search_params=SEARCH_PARAMS,
+        )
+        docs_by_query = await _postprocess_hits(collection_names, request.queries, docs_by_query, metadata_filters)
+    semaphore = asyncio.Semaphore(INIT_OBJECTS.config_loader["qa_batch"]["max_concurrency"])
+
+    async def answer(index: int, input_query: str, query_embedding: tp.List[float], docs):
+        cache_key = INIT_OBJECTS.answer_cache.key(input_query, cache_scope, model_name)
+        cached_payload = INIT_OBJECTS.answer_cache.get(cache_key)
+        if cached_payload is None:
+            cached_payload = INIT_OBJECTS.semantic_cache.get(query_embedding, cache_scope, model_name)
+        if cached_payload is not None:
+            return dict(cached_payload, index=index, scoring_id=str(uuid.uuid4()))
+
+        messages = _qa_messages(input_query, [(doc.page_content, score) for doc, score in docs], model_name)
+        try:
+            async with semaphore:
+                response, span_id, trace_id = await call_llm_api(model_name=model_name, messages=messages)
+        except Exception as e:
+            logger.exception("Error answering query %s", index)
+            return dict(index=index, error=str(e))
+        response_payload = dict(
+            scoring_id=str(uuid.uuid4()),
+            context=docs,
+            answer=response.choices[0].message.content,
+            span_id=str(span_id),
+            trace_id=str(trace_id),
+        )
+        INIT_OBJECTS.answer_cache.set(cache_key, response_payload)
+        INIT_OBJECTS.semantic_cache.set(query_embedding, cache_scope, model_name, response_payload)
+        return dict(response_payload, index=index)
+
+    async def json_lines():
+        tasks = [
+            asyncio.create_task(answer(index, input_query, query_embedding, docs))
+            for index, (input_query, query_embedding, docs) in enumerate(
+                zip(request.queries, query_embeddings, docs_by_query)
+            )
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                response_payload = await task
+                yield json.dumps(jsonable_encoder(response_payload), ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(json_lines(), media_type="application/x-ndjson")
+
+
+@APP.get("/qa/stream", dependencies=[Depends(_rate_limit_expensive)])
+@timeit
+@track_request
+async def qa_stream(
+    input_query: str = DEFAULT_INPUT_QUERY,
+    collection_name: str = DEFAULT_COLLECTION_NAME,
+    model_name: str = INIT_OBJECTS.config_loader["llm_model_name"],
+    input_original_query: str | None = None,
+    ip_request_client: ipaddress.IPv4Address | None = None,
+    metadata_filters: tp.Dict[str, tp.List[str] | None] = Depends(_metadata_filters),
+):
+    """Streaming variant of /qa using server-sent events.
+
+    Emits a `context` event as soon as the retrieval finishes, one `token` event per chunk of the LLM completion and
+    a final `done` event with the ids required by /qa_feedback.
+    """
+    logger = lg.getLogger(qa_stream.__name__)
+    logger.info(input_query)
+    collection_names = _collection_names(collection_name)
+    collection_name = ",".join(collection_names)
+    cache_scope = _cache_scope(collection_names, metadata_filters)
+
+    cache_key = INIT_OBJECTS.answer_cache.key(input_query, cache_scope, model_name)
+    cached_payload = INIT_OBJECTS.answer_cache.get(cache_key)
+    query_embedding = None
+    if cached_payload is None:
+        embeddings = INIT_OBJECTS.vector_store[collection_names[0]].embeddings
+        query_embedding = await embeddings.aembed_query(input_query)
+        cached_payload = INIT_OBJECTS.semantic_cache.get(query_embedding, cache_scope, model_name)
+
+    async def cached_events():
+        yield _sse_event("context", cached_payload["context"])
+        yield _sse_event("token", {"content": cached_payload["answer"]})
+        yield _sse_event(
+            "done",
+            dict(
+                scoring_id=str(uuid.uuid4()),
+                span_id=cached_payload["span_id"],
+                trace_id=cached_payload["trace_id"],
+            ),
+        )
+
+    async def llm_events():
+        try:
+            async for event in _llm_events():
+                yield event
+        except AdmissionRejected as e:
+            # The response has already started, errors are sent as events
+            yield _sse_event("error", {"detail": str(e), "retry_after": e.retry_after_seconds})
+        except Exception as e:
+            logger.exception("Error streaming the answer")
+            yield _sse_event("error", {"detail": str(e)})
+
+    async def _llm_events():
+        docs = await _search(collection_names, query_embedding, input_query, metadata_filters)
+        yield _sse_event("context", docs)
+
+        messages = _qa_messages(input_query, [(doc.page_content, score) for doc, score in docs], model_name)
+        additional_attributes = {
+            "db.collection.name": collection_name,
+            "service.ip": ip_request_client,
+            "llm.original_query": input_original_query,
+        }
+        chunks = asyncio.Queue()
+        completion = asyncio.ensure_future(
+            inject_additional_attributes(
+                lambda: call_llm_api_stream(model_name=model_name, messages=messages, on_chunk=chunks.put_nowait),
+                additional_attributes,
+            )
+        )
+        completion.add_done_callback(lambda _: chunks.put_nowait(None))
+        answer_parts = []
+        try:
+            while (chunk := await chunks.get()) is not None:
+                if chunk.usage is not None:
+                    logger.info(chunk.usage)
+                    record_llm_usage(model_name, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer_parts.append(chunk.choices[0].delta.content)
+                    yield _sse_event("token", {"content": chunk.choices[0].delta.content})
+            span_id, trace_id = completion.result()
+        finally:
+            completion.cancel()
+        answer = "".join(answer_parts)
+        logger.info(answer)
+
+        response_payload = dict(
+            scoring_id=str(uuid.uuid4()),
+            context=docs,
+            answer=answer,
+            span_id=str(span_id),
+            trace_id=str(trace_id),
+        )
+        INIT_OBJECTS.answer_cache.set(cache_key, response_payload)
+        INIT_OBJECTS.semantic_cache.set(query_embedding, cache_scope, model_name, response_payload)
+        yield _sse_event(
+            "done", dict(scoring_id=response_payload["scoring_id"], span_id=str(span_id), trace_id=str(trace_id))
+        )
+
+    events = cached_events() if cached_payload is not None else llm_events()
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@APP.get("/qa_tavily", dependencies=[Depends(_rate_limit_expensive)])
+@timeit
+@track_request
 async def qa_tavily(input_query: str = DEFAULT_INPUT_QUERY):
     logger = lg.getLogger(qa_tavily.__name__)
     logger.info(input_query)
 
     # Getting context from internet browser (Tavily)
-    docs = INIT_OBJECTS.tavily_client.search(
+    docs = await INIT_OBJECTS.tavily_client.search(
         query=input_query,
         search_depth="advanced",
         include_domains=["https://www.boe.es/"],
@@ -171,31 +741,21 @@ async def qa_tavily(input_query: str = DEFAULT_INPUT_QUERY):
     )
 
     # Generate response using a LLM (OpenAI)
-    context_preprocessed = [{"context": doc["content"], "score": doc["score"]} for doc in docs["results"]]
-
-    response = await INIT_OBJECTS.openai_client.chat.completions.create(
-        model=INIT_OBJECTS.config_loader["llm_model_name"],
-        messages=[
-            {"role": "system", "content": INIT_OBJECTS.config_loader["prompt_system"]},
-            {
-                "role": "system",
-                "content": INIT_OBJECTS.config_loader["prompt_system_context"],
-            },
-            {"role": "system", "content": "A continuación se proporciona el contexto:"},
-            {"role": "system", "content": str(context_preprocessed)},
-            {
-                "role": "system",
-                "content": "A continuación se proporciona la pregunta del usuario:",
-            },
-            {"role": "user", "content": input_query},
-        ],
-        temperature=INIT_OBJECTS.config_loader["temperature"],
-        seed=INIT_OBJECTS.config_loader["seed"],
-        max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
-    )
+    model_name = INIT_OBJECTS.config_loader["llm_model_name"]
+    messages = _qa_messages(input_query, [(doc["content"], doc["score"]) for doc in docs["results"]], model_name)
+
+    async with LLM_ADMISSION.slot():
+        response = await INIT_OBJECTS.openai_client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            temperature=INIT_OBJECTS.config_loader["temperature"],
+            seed=INIT_OBJECTS.config_loader["seed"],
+            max_tokens=INIT_OBJECTS.config_loader["max_tokens"],
+        )
     answer = response.choices[0].message.content
     logger.info(answer)
     logger.info(response.usage)
+    record_llm_usage(model_name, response.usage)
 
     response_payload = dict(
         scoring_id=str(uuid.uuid4()),
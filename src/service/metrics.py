@@ -0,0 +1,152 @@
+"""Prometheus metrics of the service.
+
+With several uvicorn workers, set `PROMETHEUS_MULTIPROC_DIR` to an empty directory before starting them (see the
+Dockerfile): every worker then writes its metrics there and `/metrics` aggregates all of them, whichever worker serves
+the scrape.
+"""
+import os
+import time
+import typing as tp
+from functools import wraps
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram(
+    "justicio_request_duration_seconds",
+    "Total latency of the requests by endpoint",
+    ["endpoint"],
+    buckets=DEFAULT_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "justicio_requests_in_flight", "Requests being processed by endpoint", ["endpoint"], multiprocess_mode="livesum"
+)
+STAGE_LATENCY = Histogram(
+    "justicio_stage_duration_seconds",
+    "Latency of each stage of the RAG pipeline",
+    ["endpoint", "stage"],
+    buckets=DEFAULT_BUCKETS,
+)
+LLM_TOKENS = Counter("justicio_llm_tokens", "Tokens used by the LLM API", ["model", "type"])
+CACHE_HITS = Counter("justicio_cache_hits", "Hits of the in-process caches", ["cache"])
+CACHE_MISSES = Counter("justicio_cache_misses", "Misses of the in-process caches", ["cache"])
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "justicio_admission_queue_depth",
+    "Calls waiting for a slot of an admission controller",
+    ["controller"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "justicio_admission_in_flight",
+    "Calls holding a slot of an admission controller",
+    ["controller"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_WAIT = Histogram(
+    "justicio_admission_wait_seconds",
+    "Time waited for a slot of an admission controller",
+    ["controller"],
+    buckets=DEFAULT_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "justicio_admission_rejected", "Calls rejected by an admission controller", ["controller", "reason"]
+)
+
+RATE_LIMITED = Counter("justicio_rate_limited", "Requests rejected by the per-client rate limits", ["limit"])
+
+# Caches whose hits and misses are exported, and the totals already added to the counters
+_CACHES: tp.Dict[str, tp.Any] = {}
+_reported_totals: tp.Dict[tp.Tuple[str, str], int] = {}
+
+
+def track_request(func):
+    """Records the latency and the in-flight requests of an endpoint.
+
+    Streaming responses are tracked until their body has been sent, not when the endpoint returns them.
+    """
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        REQUESTS_IN_FLIGHT.labels(endpoint=func.__name__).inc()
+        start_time = time.perf_counter()
+        streaming = False
+        try:
+            response = await func(*args, **kwargs)
+            if hasattr(response, "body_iterator"):
+                response.body_iterator = _track_body(response.body_iterator, func.__name__, start_time)
+                streaming = True
+            return response
+        finally:
+            if not streaming:
+                _finish_request(func.__name__, start_time)
+
+    return wrapper
+
+
+async def _track_body(body_iterator: tp.AsyncIterator, endpoint: str, start_time: float) -> tp.AsyncIterator:
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        _finish_request(endpoint, start_time)
+
+
+def _finish_request(endpoint: str, start_time: float) -> None:
+    REQUEST_LATENCY.labels(endpoint=endpoint).observe(time.perf_counter() - start_time)
+    REQUESTS_IN_FLIGHT.labels(endpoint=endpoint).dec()
+    record_cache_stats()
+
+
+def stage_timer(endpoint: str, stage: str):
+    return STAGE_LATENCY.labels(endpoint=endpoint, stage=stage).time()
+
+
+def record_llm_usage(model_name: str, usage) -> None:
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model=model_name, type="prompt").inc(usage.prompt_tokens)
+    LLM_TOKENS.labels(model=model_name, type="completion").inc(usage.completion_tokens)
+
+
+def register_caches(caches: tp.Dict[str, tp.Any]) -> None:
+    """Caches (with `hits` and `misses` attributes) exported as counters, updated at the end of every request"""
+    _CACHES.update(caches)
+
+
+def record_cache_stats() -> None:
+    """Adds to the counters the hits and misses of the caches since the last call"""
+    for cache_name, cache in _CACHES.items():
+        for counter, kind, total in ((CACHE_HITS, "hits", cache.hits), (CACHE_MISSES, "misses", cache.misses)):
+            delta = total - _reported_totals.get((cache_name, kind), 0)
+            if delta > 0:
+                counter.labels(cache=cache_name).inc(delta)
+                _reported_totals[(cache_name, kind)] = total
+
+
+def mark_process_dead() -> None:
+    """Drops the live gauges of this worker from the multiprocess metrics, when it shuts down"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics() -> tp.Tuple[bytes, str]:
+    """Metrics in the Prometheus text exposition format, of all the workers in multiprocess mode
+
+    :return: the body and its content type
+    """
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging as lg
+import mmap
+import os
+import shutil
+import typing as tp
+
+import numpy as np
+from langchain.schema import Document
+from qdrant_client.models import FieldCondition, Filter, MatchAny, MatchValue, SearchParams
+
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+PAYLOADS_FILE = "payloads.jsonl"
+OFFSETS_FILE = "offsets.npy"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+META_FILE = "meta.json"
+BLOCK_SIZE = 65536  # rows converted to float32 at a time
+
+
+class MmapVectorStore:
+    """In-process vector store of a collection exported from Qdrant, for collections small enough to fit in RAM.
+
+    The embeddings are a memory-mapped float32 or int8 matrix (int8 with a scale per vector) and the payloads a JSON
+    lines file read through the byte offsets of each point, so the uvicorn workers share the pages through the OS page
+    cache. Searches are exact and vectorized with numpy, or restricted to the `nprobe` closest IVF lists when the
+    export was partitioned.
+    """
+
+    def __init__(self, path: str, nprobe: int):
+        logger = lg.getLogger(self.__class__.__name__)
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.collection_name = meta["collection_name"]
+        self.distance = meta["distance"]
+        self._vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self._scales = np.load(os.path.join(path, SCALES_FILE), mmap_mode="r") if meta["dtype"] == "int8" else None
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(path, PAYLOADS_FILE), "rb") as f:
+            self._payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._centroids = None
+        self._list_offsets = None
+        if meta["ivf_lists"]:
+            self._centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+            self._list_offsets = np.load(os.path.join(path, LIST_OFFSETS_FILE))
+        self._nprobe = nprobe
+        self._squared_norms = None
+        if self.distance == "Euclid":
+            self._squared_norms = np.concatenate(
+                [self._squared_norms_block(i) for i in range(0, len(self), BLOCK_SIZE)] or [np.empty(0, np.float32)]
+            )
+        self._field_values: tp.Dict[str, np.ndarray] = {}
+        logger.info("Loaded in-process vector store [%s] with %s vectors", self.collection_name, len(self))
+
+    def __len__(self) -> int:
+        return self._vectors.shape[0]
+
+    async def asimilarity_search_with_score_by_vector(
+        self,
+        embedding: tp.List[float],
+        k: int,
+        filter: tp.Optional[Filter] = None,
+        search_params: tp.Optional[SearchParams] = None,
+        **kwargs,
+    ) -> tp.List[tp.Tuple[Document, float]]:
+        return await asyncio.to_thread(self.similarity_search_with_score_by_vector, embedding, k, filter)
+
+    async def asearch_batch(
+        self,
+        embeddings: tp.List[tp.List[float]],
+        k: int,
+        filter: tp.Optional[Filter] = None,
+        search_params: tp.Optional[SearchParams] = None,
+    ) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+        return await asyncio.to_thread(
+            lambda: [self.similarity_search_with_score_by_vector(embedding, k, filter) for embedding in embeddings]
+        )
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: tp.List[float], k: int, filter: tp.Optional[Filter] = None
+    ) -> tp.List[tp.Tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        if self.distance == "Cosine":
+            norm = np.linalg.norm(query)
+            query = query / norm if norm else query
+        ids = self._candidate_ids(query)
+        if filter is not None:
+            ids = np.arange(len(self)) if ids is None else ids
+            ids = ids[self._filter_mask(filter, ids)]
+        if (len(self) if ids is None else ids.size) == 0:
+            return []
+        scores = self._dot(query, ids)
+        if self.distance == "Euclid":
+            # Qdrant returns the distance as the score of Euclid collections, lower is better
+            squared_norms = self._squared_norms if ids is None else self._squared_norms[ids]
+            scores = -np.sqrt(np.maximum(squared_norms - 2 * scores + query @ query, 0))
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        sign = -1 if self.distance == "Euclid" else 1
+        return [(self._document(int(i if ids is None else ids[i])), sign * float(scores[i])) for i in top]
+
+    def _candidate_ids(self, query: np.ndarray) -> tp.Optional[np.ndarray]:
+        """Points of the `nprobe` closest IVF lists, or None (all of them) for an exact search"""
+        if self._centroids is None:
+            return None
+        nprobe = min(self._nprobe, self._centroids.shape[0])
+        if self.distance == "Euclid":
+            centroid_scores = -np.linalg.norm(self._centroids - query, axis=1)
+        else:
+            centroid_scores = self._centroids @ query
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([np.arange(self._list_offsets[i], self._list_offsets[i + 1]) for i in lists])
+
+    def _dot(self, query: np.ndarray, ids: tp.Optional[np.ndarray] = None) -> np.ndarray:
+        """Dot products of the query with the points `ids`, or with all the points straight from the memmap.
+
+        Only the candidate rows are gathered. int8 vectors are converted to float32 a block at a time and scaled after
+        the dot product, so a search never holds a float32 copy of the matrix.
+        """
+        vectors = self._vectors if ids is None else self._vectors[ids]
+        if self._scales is None:
+            return vectors @ query
+        scores = np.concatenate(
+            [vectors[i : i + BLOCK_SIZE].astype(np.float32) @ query for i in range(0, len(vectors), BLOCK_SIZE)]
+        )
+        return scores * (self._scales if ids is None else self._scales[ids])
+
+    def _squared_norms_block(self, start: int) -> np.ndarray:
+        vectors = self._vectors[start : start + BLOCK_SIZE].astype(np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[start : start + BLOCK_SIZE][:, None]
+        return np.einsum("ij,ij->i", vectors, vectors)
+
+    def _filter_mask(self, query_filter: Filter, ids: np.ndarray) -> np.ndarray:
+        """Evaluates the filters built by `build_filter`: every condition must match any of its values"""
+        if query_filter.should or query_filter.must_not:
+            raise ValueError("Only `must` filters are supported by the in-process vector store")
+        mask = np.ones(ids.size, dtype=bool)
+        for condition in query_filter.must or []:
+            if not isinstance(condition, FieldCondition) or not isinstance(condition.match, (MatchAny, MatchValue)):
+                raise ValueError(f"Unsupported filter condition in the in-process vector store: {condition}")
+            values = condition.match.any if isinstance(condition.match, MatchAny) else [condition.match.value]
+            mask &= np.isin(self._field(condition.key)[ids], [str(value) for value in values])
+        return mask
+
+    def _field(self, key: str) -> np.ndarray:
+        """Values of a payload field (dot notation) of all the points, decoded once on first use"""
+        if key not in self._field_values:
+            values = []
+            for i in range(len(self)):
+                value = json.loads(self._payload_bytes(i))
+                for part in key.split("."):
+                    value = value.get(part) if isinstance(value, dict) else None
+                values.append("" if value is None else str(value))
+            self._field_values[key] = np.array(values, dtype=object)
+        return self._field_values[key]
+
+    def _payload_bytes(self, i: int) -> bytes:
+        return self._payloads[int(self._offsets[i]) : int(self._offsets[i + 1])]
+
+    def _document(self, i: int) -> Document:
+        payload = json.loads(self._payload_bytes(i))
+        return Document(page_content=payload.get("page_content") or "", metadata=payload.get("metadata") or {})
+
+
+def export_qdrant_collection(
+    qdrant_client,
+    collection_name: str,
+    path: str,
+    dtype: str = "float32",
+    ivf_lists: int = 0,
+    batch_size: int = 1024,
+) -> None:
+    """Exports the vectors and payloads of a Qdrant collection to the files read by `MmapVectorStore`.
+
+    The export is written to a temporary directory that replaces `path` at the end, so running stores keep reading
+    the previous files.
+    """
+    logger = lg.getLogger(export_qdrant_collection.__name__)
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"Unknown dtype: {dtype}")
+    distance = qdrant_client.get_collection(collection_name).config.params.vectors.distance.value
+    vectors = []
+    payloads = []
+    offset = None
+    while True:
+        points, offset = qdrant_client.scroll(
+            collection_name, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        for point in points:
+            vectors.append(point.vector)
+            payloads.append(json.dumps(point.payload, ensure_ascii=False).encode("utf-8"))
+        logger.info("Exported %s points of collection [%s]", len(vectors), collection_name)
+        if offset is None:
+            break
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if distance == "Cosine":
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    order = np.arange(len(vectors))
+    centroids = list_offsets = None
+    if ivf_lists:
+        centroids, assignments = _kmeans(vectors, ivf_lists, distance)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=ivf_lists))])
+    vectors = vectors[order]
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    if dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        np.save(os.path.join(tmp_path, SCALES_FILE), scales.astype(np.float32))
+        vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+    np.save(os.path.join(tmp_path, VECTORS_FILE), vectors)
+    offsets = [0]
+    with open(os.path.join(tmp_path, PAYLOADS_FILE), "wb") as f:
+        for i in order:
+            f.write(payloads[i] + b"\n")
+            offsets.append(offsets[-1] + len(payloads[i]) + 1)
+    np.save(os.path.join(tmp_path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    if ivf_lists:
+        np.save(os.path.join(tmp_path, CENTROIDS_FILE), centroids)
+        np.save(os.path.join(tmp_path, LIST_OFFSETS_FILE), list_offsets)
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump(dict(collection_name=collection_name, distance=distance, dtype=dtype, ivf_lists=ivf_lists), f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info("Exported collection [%s] to [%s]", collection_name, path)
+
+
+def _kmeans(
+    vectors: np.ndarray, n_lists: int, distance: str, n_iterations: int = 20, seed: int = 42
+) -> tp.Tuple[np.ndarray, np.ndarray]:
+    """Lloyd's k-means: centroids of the IVF lists and the list of every vector"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=min(n_lists, len(vectors)), replace=False)].copy()
+    for _ in range(n_iterations):
+        if distance == "Euclid":
+            assignments = np.argmin(
+                (vectors**2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T + (centroids**2).sum(axis=1), axis=1
+            )
+        else:
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(centroids.shape[0]):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        if distance == "Cosine":
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids, assignments
+
+
+def export(collection_name: str, dtype: str = "float32", ivf_lists: int = 0):
+    """Exports a Qdrant collection to the `mmap_vector_store` directory"""
+    from qdrant_client import QdrantClient
+
+    from src.initialize import _init_config, initialize_logging
+
+    initialize_logging()
+    config_loader = _init_config()
+    qdrant_client = QdrantClient(url=os.environ["QDRANT_API_URL"], api_key=os.environ["QDRANT_API_KEY"])
+    export_qdrant_collection(
+        qdrant_client,
+        collection_name,
+        os.path.join(os.environ["APP_PATH"], config_loader["mmap_vector_store"]["dir"], collection_name),
+        dtype=dtype,
+        ivf_lists=ivf_lists,
+    )
+
+
+if __name__ == "__main__":
+    import typer
+
+    app = typer.Typer()
+    # A callback keeps `export` as a subcommand of the single-command app
+    app.callback()(lambda: None)
+    app.command()(export)
+    app()
@@ -0,0 +1,85 @@
+import logging as lg
+import os
+import typing as tp
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+
+class OnnxEmbeddings(Embeddings):
+    """CPU embeddings backend running an ONNX export of a sentence-transformers model with onnxruntime.
+
+    The model is exported (and dynamically quantized to int8 when `quantize` is set) into `model_dir` the first time,
+    and loaded from there afterwards. Requires the optional `optimum[onnxruntime]` dependency.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        model_dir: str,
+        quantize: bool = True,
+        pooling: str = "mean",
+        max_length: int = 512,
+        intra_op_num_threads: int = 0,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if pooling not in ("mean", "cls"):
+            raise ValueError(f"Pooling [{pooling}] not supported")
+        model_path = _export_model(model_name, model_dir, quantize)
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = intra_op_num_threads
+        self._session = ort.InferenceSession(model_path, session_options, providers=["CPUExecutionProvider"])
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._pooling = pooling
+        self._max_length = max_length
+
+    def embed_documents(self, texts: tp.List[str]) -> tp.List[tp.List[float]]:
+        if not texts:
+            return []
+        encoded = self._tokenizer(
+            texts, padding=True, truncation=True, max_length=self._max_length, return_tensors="np"
+        )
+        inputs = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+        token_embeddings = self._session.run(None, inputs)[0]
+        if self._pooling == "cls":
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return embeddings.tolist()
+
+    def embed_query(self, text: str) -> tp.List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _export_model(model_name: str, model_dir: str, quantize: bool) -> str:
+    """Exports the model to ONNX (and quantizes it) unless it is already in `model_dir`"""
+    logger = lg.getLogger(_export_model.__name__)
+    model_file = ONNX_QUANTIZED_MODEL_FILE if quantize else ONNX_MODEL_FILE
+    model_path = os.path.join(model_dir, model_file)
+    if os.path.exists(model_path):
+        return model_path
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info("Exporting [%s] to ONNX in [%s]", model_name, model_dir)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(model_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+    if quantize:
+        logger.info("Quantizing ONNX model to int8")
+        quantizer = ORTQuantizer.from_pretrained(model_dir, file_name=ONNX_MODEL_FILE)
+        quantizer.quantize(
+            save_dir=model_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        )
+    logger.info("Exported [%s] to ONNX", model_name)
+    return model_path
@@ -0,0 +1,95 @@
+import asyncio
+import typing as tp
+
+import httpx
+from langchain.schema import Document
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Filter, ScoredPoint, SearchParams, SearchRequest
+
+
+class AsyncQdrantCollection:
+    """Searches a collection with the native async Qdrant client, skipping LangChain's thread-pool hop.
+
+    It takes precomputed query vectors and only fetches the payload fields listed in `payload_fields` (dot notation
+    for nested metadata fields). It exposes the same search method as the LangChain vector stores, so both can be
+    used by `search_collections`.
+    """
+
+    def __init__(
+        self,
+        client: AsyncQdrantClient,
+        collection_name: str,
+        payload_fields: tp.List[str],
+        timeout_seconds: float,
+        content_payload_key: str = "page_content",
+        metadata_payload_key: str = "metadata",
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self._payload_fields = payload_fields
+        self._timeout_seconds = timeout_seconds
+        self._content_payload_key = content_payload_key
+        self._metadata_payload_key = metadata_payload_key
+
+    async def asimilarity_search_with_score_by_vector(
+        self, embedding: tp.List[float], k: int, filter: tp.Optional[Filter] = None, **kwargs
+    ) -> tp.List[tp.Tuple[Document, float]]:
+        points = await asyncio.wait_for(
+            self.client.search(
+                collection_name=self.collection_name,
+                query_vector=embedding,
+                query_filter=filter,
+                limit=k,
+                with_payload=self._payload_fields,
+                **kwargs,
+            ),
+            self._timeout_seconds,
+        )
+        return [self._document_with_score(point) for point in points]
+
+    async def asearch_batch(
+        self,
+        embeddings: tp.List[tp.List[float]],
+        k: int,
+        filter: tp.Optional[Filter] = None,
+        search_params: tp.Optional[SearchParams] = None,
+    ) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+        requests = [
+            SearchRequest(
+                vector=embedding, filter=filter, params=search_params, limit=k, with_payload=self._payload_fields
+            )
+            for embedding in embeddings
+        ]
+        results = await asyncio.wait_for(
+            self.client.search_batch(collection_name=self.collection_name, requests=requests), self._timeout_seconds
+        )
+        return [[self._document_with_score(point) for point in points] for points in results]
+
+    def _document_with_score(self, point: ScoredPoint) -> tp.Tuple[Document, float]:
+        payload = point.payload or {}
+        document = Document(
+            page_content=payload.get(self._content_payload_key) or "",
+            metadata=payload.get(self._metadata_payload_key) or {},
+        )
+        return document, point.score
+
+
+def init_async_qdrant_collections(
+    url: str,
+    api_key: str,
+    collection_names: tp.List[str],
+    pool_size: int,
+    timeout_seconds: float,
+    payload_fields: tp.List[str],
+) -> tp.Dict[str, AsyncQdrantCollection]:
+    """Async search backends of the collections, sharing one client and its pool of connections"""
+    client = AsyncQdrantClient(
+        url=url,
+        api_key=api_key,
+        timeout=timeout_seconds,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+    )
+    return {
+        collection_name: AsyncQdrantCollection(client, collection_name, payload_fields, timeout_seconds)
+        for collection_name in collection_names
+    }
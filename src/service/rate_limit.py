@@ -0,0 +1,68 @@
+import collections
+import math
+import threading
+import time
+import typing as tp
+
+
+class TokenBucketRateLimiter:
+    """Per-client token buckets: each client gets `burst` tokens, refilled at `rate_per_second`.
+
+    Buckets are kept in least recently used order, so clients idle for more than `idle_seconds` are dropped from the
+    front on every call and at most `max_clients` buckets are kept. A dropped client starts again with a full bucket,
+    which is what an idle client would have anyway once `idle_seconds` >= `burst / rate_per_second`. Buckets still in
+    debt after a cost above `burst` are kept until they refill.
+
+    Buckets live in the memory of each process, so with several uvicorn workers each worker enforces its own limit.
+    """
+
+    def __init__(self, rate_per_second: float, burst: float, max_clients: int, idle_seconds: float):
+        self._rate_per_second = rate_per_second
+        self._burst = burst
+        self._max_clients = max_clients
+        self._idle_seconds = idle_seconds
+        self._buckets: tp.OrderedDict[str, tp.Tuple[float, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str, cost: float = 1) -> float:
+        """Takes `cost` tokens from the bucket of the client.
+
+        A cost above `burst` is allowed once the bucket is full and leaves it in debt (negative), so the client pays
+        the full cost before its next call.
+
+        :return: 0 if allowed, otherwise the seconds until the bucket has enough tokens
+        """
+        required = min(cost, self._burst)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            tokens, updated_at = self._buckets.pop(client, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - updated_at) * self._rate_per_second)
+            wait_seconds = 0.0
+            if tokens >= required:
+                tokens -= cost
+            else:
+                wait_seconds = (required - tokens) / self._rate_per_second
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self._max_clients:
+                self._buckets.popitem(last=False)
+            return wait_seconds
+
+    def _expire(self, now: float) -> None:
+        while self._buckets:
+            client, (tokens, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self._idle_seconds:
+                break
+            del self._buckets[client]
+            tokens += (now - updated_at) * self._rate_per_second
+            if tokens < self._burst:
+                # Still paying off a cost above `burst`: the bucket is kept, refilled up to now
+                self._buckets[client] = (tokens, now)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def retry_after(wait_seconds: float) -> str:
+    """Value of the Retry-After header, in whole seconds"""
+    return str(max(1, math.ceil(wait_seconds)))
@@ -0,0 +1,66 @@
+import asyncio
+import concurrent.futures
+import logging as lg
+import typing as tp
+
+from langchain.schema import Document
+
+
+class CrossEncoderReranker:
+    """Reranks the retrieved chunks with a CPU cross-encoder within a time budget.
+
+    All the (query, chunk) pairs of a request, or of all the queries of a batch, are scored in a single `predict` call
+    on a single thread. A running `predict` can't be interrupted, so when the budget runs out, or the thread is still
+    busy with a previous call, the retrieval order is kept at once instead of queueing behind it.
+    """
+
+    def __init__(self, model_name: str, max_length: int):
+        from sentence_transformers import CrossEncoder
+
+        self._model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self._thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._busy = False
+        self.timeouts = 0
+        self.skipped = 0
+
+    async def rerank(
+        self, query: str, docs: tp.List[tp.Tuple[Document, float]], top_n: int, timeout_ms: float
+    ) -> tp.List[tp.Tuple[Document, float]]:
+        return (await self.rerank_batch([query], [docs], top_n, timeout_ms))[0]
+
+    async def rerank_batch(
+        self,
+        queries: tp.List[str],
+        docs_by_query: tp.List[tp.List[tp.Tuple[Document, float]]],
+        top_n: int,
+        timeout_ms: float,
+    ) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+        logger = lg.getLogger(self.rerank_batch.__name__)
+        pairs = [(query, doc.page_content) for query, docs in zip(queries, docs_by_query) for doc, _ in docs]
+        if not pairs:
+            return docs_by_query
+        if self._busy:
+            self.skipped += 1
+            logger.warning("Reranker busy, keeping the retrieval order")
+            return [docs[:top_n] for docs in docs_by_query]
+        self._busy = True
+        future = self._thread_pool.submit(self._model.predict, pairs)
+        # Cleared when `predict` really ends, not when the wait below gives up
+        future.add_done_callback(self._release)
+        try:
+            scores = await asyncio.wait_for(asyncio.wrap_future(future), timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("Reranking exceeded %sms, keeping the retrieval order", timeout_ms)
+            return [docs[:top_n] for docs in docs_by_query]
+        reranked_by_query = []
+        offset = 0
+        for docs in docs_by_query:
+            doc_scores = scores[offset : offset + len(docs)]
+            offset += len(docs)
+            reranked = sorted(zip((doc for doc, _ in docs), doc_scores), key=lambda doc: doc[1], reverse=True)
+            reranked_by_query.append([(doc, float(score)) for doc, score in reranked[:top_n]])
+        return reranked_by_query
+
+    def _release(self, _future: concurrent.futures.Future) -> None:
+        self._busy = False
@@ -0,0 +1,212 @@
+import asyncio
+import typing as tp
+
+from langchain.schema import Document
+from langchain.vectorstores.qdrant import Qdrant
+from qdrant_client.models import (
+    FieldCondition,
+    Filter,
+    MatchAny,
+    NamedVector,
+    QuantizationSearchParams,
+    SearchParams,
+    SearchRequest,
+)
+
+
+ALL_COLLECTIONS = "all"
+
+
+def parse_collection_names(collection_name: str, collections: tp.List[str]) -> tp.List[str]:
+    """Collections requested by a `collection_name` parameter: a single name, comma-separated names or 'all'
+
+    :raise ValueError: if no collection is given or some of them are unknown
+    """
+    if collection_name == ALL_COLLECTIONS:
+        return list(collections)
+    collection_names = list(dict.fromkeys(name.strip() for name in collection_name.split(",") if name.strip()))
+    if not collection_names:
+        raise ValueError("No collection given")
+    unknown_names = [name for name in collection_names if name not in collections]
+    if unknown_names:
+        raise ValueError(f"Unknown collections: {', '.join(unknown_names)}")
+    return collection_names
+
+
+def build_filter(metadata_filters: tp.Dict[str, tp.Optional[tp.List[str]]]) -> tp.Optional[Filter]:
+    """Qdrant filter matching any of the values given for each metadata field (all the fields must match)"""
+    conditions = [
+        FieldCondition(key=f"metadata.{field}", match=MatchAny(any=values))
+        for field, values in metadata_filters.items()
+        if values
+    ]
+    return Filter(must=conditions) if conditions else None
+
+
+def collection_index_config(config_loader: tp.Dict[str, tp.Any], collection_name: str) -> tp.Dict[str, tp.Any]:
+    """Index settings of a collection: the `collection_index` defaults overridden by the entries of the collection"""
+    index_config = config_loader["collection_index"]
+    overrides = index_config.get(collection_name) or {}
+    merged = dict(index_config["default"])
+    for key, value in overrides.items():
+        merged[key] = {**merged[key], **value} if isinstance(value, dict) and merged.get(key) else value
+    return merged
+
+
+def build_search_params(index_config: tp.Dict[str, tp.Any]) -> tp.Optional[SearchParams]:
+    """Search parameters matching the index of a collection (rescoring and oversampling of quantized vectors)"""
+    search_config = index_config["search"]
+    quantization = None
+    if index_config["quantization"]:
+        quantization = QuantizationSearchParams(
+            rescore=search_config["rescore"], oversampling=search_config["oversampling"]
+        )
+    if quantization is None and search_config["hnsw_ef"] is None:
+        return None
+    return SearchParams(hnsw_ef=search_config["hnsw_ef"], quantization=quantization)
+
+
+def filter_key(metadata_filters: tp.Dict[str, tp.Optional[tp.List[str]]]) -> str:
+    """Canonical text of the metadata filters, to tell apart cached answers of different filters"""
+    return ";".join(
+        f"{field}={','.join(sorted(values))}" for field, values in sorted(metadata_filters.items()) if values
+    )
+
+
+async def search_collections(
+    vector_stores: tp.Dict[str, tp.Any],
+    collection_names: tp.List[str],
+    query_embedding: tp.List[float],
+    k: int,
+    higher_is_better: bool = True,
+    query_filter: tp.Optional[Filter] = None,
+    search_params: tp.Optional[tp.Dict[str, tp.Optional[SearchParams]]] = None,
+) -> tp.List[tp.Tuple[Document, float]]:
+    """Searches the collections concurrently with the same query embedding and merges the hits in a top-k list.
+
+    Each document gets the collection it comes from in `metadata['collection_name']` when searching more than one.
+
+    :param search_params: search parameters of each collection, see `build_search_params`
+    """
+    search_params = search_params or {}
+    if len(collection_names) == 1:
+        return await vector_stores[collection_names[0]].asimilarity_search_with_score_by_vector(
+            embedding=query_embedding, k=k, filter=query_filter, search_params=search_params.get(collection_names[0])
+        )
+    results = await asyncio.gather(
+        *(
+            vector_stores[collection_name].asimilarity_search_with_score_by_vector(
+                embedding=query_embedding, k=k, filter=query_filter, search_params=search_params.get(collection_name)
+            )
+            for collection_name in collection_names
+        )
+    )
+    return _merge(collection_names, results, k, higher_is_better)
+
+
+async def batch_search_collections(
+    vector_stores: tp.Dict[str, tp.Any],
+    collection_names: tp.List[str],
+    query_embeddings: tp.List[tp.List[float]],
+    k: int,
+    higher_is_better: bool = True,
+    query_filter: tp.Optional[Filter] = None,
+    search_params: tp.Optional[tp.Dict[str, tp.Optional[SearchParams]]] = None,
+) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+    """Searches many query embeddings with a single Qdrant batch request per collection.
+
+    :return: the top-k hits of every query, in the same order as `query_embeddings`
+    """
+    results = await asyncio.gather(
+        *(
+            _abatch_search_collection(
+                vector_stores[collection_name],
+                query_embeddings,
+                k,
+                query_filter,
+                (search_params or {}).get(collection_name),
+            )
+            for collection_name in collection_names
+        )
+    )
+    if len(collection_names) == 1:
+        return results[0]
+    return [_merge(collection_names, query_results, k, higher_is_better) for query_results in zip(*results)]
+
+
+async def _abatch_search_collection(
+    vector_store: tp.Any,
+    query_embeddings: tp.List[tp.List[float]],
+    k: int,
+    query_filter: tp.Optional[Filter],
+    search_params: tp.Optional[SearchParams],
+) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+    # The async backends (`AsyncQdrantCollection`, `MmapVectorStore`) batch natively, LangChain's Qdrant doesn't
+    if hasattr(vector_store, "asearch_batch"):
+        return await vector_store.asearch_batch(query_embeddings, k, query_filter, search_params)
+    return await asyncio.to_thread(
+        _batch_search_collection, vector_store, query_embeddings, k, query_filter, search_params
+    )
+
+
+def _batch_search_collection(
+    vector_store: Qdrant,
+    query_embeddings: tp.List[tp.List[float]],
+    k: int,
+    query_filter: tp.Optional[Filter],
+    search_params: tp.Optional[SearchParams],
+) -> tp.List[tp.List[tp.Tuple[Document, float]]]:
+    if vector_store.vector_name:
+        query_embeddings = [NamedVector(name=vector_store.vector_name, vector=e) for e in query_embeddings]
+    requests = [
+        SearchRequest(vector=embedding, filter=query_filter, params=search_params, limit=k, with_payload=True)
+        for embedding in query_embeddings
+    ]
+    results = vector_store.client.search_batch(collection_name=vector_store.collection_name, requests=requests)
+    return [
+        [
+            (
+                vector_store._document_from_scored_point(
+                    point,
+                    vector_store.collection_name,
+                    vector_store.content_payload_key,
+                    vector_store.metadata_payload_key,
+                ),
+                point.score,
+            )
+            for point in points
+        ]
+        for points in results
+    ]
+
+
+def _merge(
+    collection_names: tp.List[str],
+    results: tp.Iterable[tp.List[tp.Tuple[Document, float]]],
+    k: int,
+    higher_is_better: bool,
+) -> tp.List[tp.Tuple[Document, float]]:
+    docs = []
+    for collection_name, collection_docs in zip(collection_names, results):
+        for doc, score in collection_docs:
+            doc.metadata["collection_name"] = collection_name
+            docs.append((doc, score))
+    docs.sort(key=lambda doc: doc[1], reverse=higher_is_better)
+    return docs[:k]
+
+
+def reciprocal_rank_fusion(
+    rankings: tp.Sequence[tp.List[tp.Tuple[Document, float]]], k: int, rrf_k: int = 60
+) -> tp.List[tp.Tuple[Document, float]]:
+    """Fuses several rankings of the same chunks with reciprocal rank fusion.
+
+    Chunks are identified by their text. Scores are the fused scores scaled to (0, 1], the first hit having 1.0.
+    """
+    fused_scores: tp.Dict[str, float] = {}
+    docs: tp.Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking):
+            fused_scores[doc.page_content] = fused_scores.get(doc.page_content, 0.0) + 1 / (rrf_k + rank + 1)
+            docs.setdefault(doc.page_content, doc)
+    best = sorted(fused_scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [(docs[text], score / best[0][1]) for text, score in best]
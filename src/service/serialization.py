@@ -0,0 +1,32 @@
+import gzip
+import typing as tp
+
+from fastapi.responses import Response
+from langchain.schema import Document
+
+
+def lean_docs(docs: tp.Iterable[tp.Tuple[Document, float]], metadata_fields: tp.Sequence[str]) -> tp.List[dict]:
+    """Search hits as plain dicts with only the chosen metadata fields, ready for a fast JSON encoder"""
+    return [
+        {
+            "page_content": doc.page_content,
+            "metadata": {field: doc.metadata[field] for field in metadata_fields if field in doc.metadata},
+            "score": score,
+        }
+        for doc, score in docs
+    ]
+
+
+def lean_qa_payload(payload: tp.Dict[str, tp.Any], metadata_fields: tp.Sequence[str]) -> tp.Dict[str, tp.Any]:
+    return dict(payload, context=lean_docs(payload["context"], metadata_fields))
+
+
+def gzip_response(response: Response, accept_encoding: str, minimum_size: int) -> Response:
+    """Compresses the body of a rendered response when the client accepts gzip and the body is large enough"""
+    if "gzip" not in accept_encoding.lower() or len(response.body) < minimum_size:
+        return response
+    response.body = gzip.compress(response.body, compresslevel=5)
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Content-Length"] = str(len(response.body))
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
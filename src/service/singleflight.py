@@ -0,0 +1,47 @@
+import asyncio
+import logging as lg
+import typing as tp
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution.
+
+    The first caller starts the work in its own task and later callers with the same key await that task. A waiter
+    that gets cancelled only stops waiting; the shared task is cancelled when no waiter is left.
+    """
+
+    def __init__(self):
+        self._calls: tp.Dict[tp.Hashable, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: tp.Hashable, fn: tp.Callable[[], tp.Awaitable[tp.Any]]) -> tp.Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            lg.getLogger(self.do.__name__).info("Coalescing request with %s waiters", call.waiters)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: tp.Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
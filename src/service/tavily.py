@@ -0,0 +1,75 @@
+import contextlib
+import logging as lg
+import typing as tp
+
+import httpx
+
+from src.service.admission import AdmissionController
+from src.service.cache import TTLCache
+
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+
+
+class AsyncTavilyClient:
+    """Non-blocking Tavily search client.
+
+    Requests share a pooled `httpx.AsyncClient` with a bounded number of connections and a timeout, and results are
+    cached by query and search parameters. Calls that miss the cache wait for a slot of `admission`, if given.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        timeout_seconds: float,
+        max_connections: int,
+        cache_max_size: int,
+        cache_ttl_seconds: float,
+        admission: tp.Optional[AdmissionController] = None,
+    ):
+        self._api_key = api_key
+        self._http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout_seconds),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.cache = TTLCache(max_size=cache_max_size, ttl_seconds=cache_ttl_seconds)
+        self._admission = admission
+
+    async def search(
+        self,
+        query: str,
+        search_depth: str = "basic",
+        topic: str = "general",
+        max_results: int = 5,
+        include_domains: tp.Sequence[str] = (),
+        exclude_domains: tp.Sequence[str] = (),
+        include_answer: bool = False,
+        include_raw_content: bool = False,
+        include_images: bool = False,
+    ) -> tp.Dict[str, tp.Any]:
+        logger = lg.getLogger(self.search.__name__)
+        params = dict(
+            query=query,
+            search_depth=search_depth,
+            topic=topic,
+            max_results=max_results,
+            include_domains=list(include_domains),
+            exclude_domains=list(exclude_domains),
+            include_answer=include_answer,
+            include_raw_content=include_raw_content,
+            include_images=include_images,
+        )
+        cache_key = (query, search_depth, topic, max_results, tuple(include_domains), tuple(exclude_domains),
+                     include_answer, include_raw_content, include_images)
+        result = self.cache.get(cache_key)
+        if result is not None:
+            logger.info("Tavily cache hit %s", self.cache.stats())
+            return result
+        async with self._admission.slot() if self._admission else contextlib.nullcontext():
+            response = await self._http_client.post(TAVILY_SEARCH_URL, json=dict(params, api_key=self._api_key))
+        response.raise_for_status()
+        result = response.json()
+        self.cache.set(cache_key, result)
+        return result
+
+    async def aclose(self) -> None:
+        await self._http_client.aclose()
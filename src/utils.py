@@ -4,7 +4,6 @@ import typing as tp
 from functools import wraps
 
 from langchain.schema import Document
-from langchain.vectorstores import SupabaseVectorStore
 from pydantic import BaseModel
 from fastapi import Request
 from opentelemetry import baggage, context
@@ -19,6 +18,17 @@ class QAResponsePayloadModel(BaseModel):
     answer: str
 
 
+class QABatchRequestModel(BaseModel):
+    queries: tp.List[str]
+    collection_name: str = "justicio"
+    model_name: tp.Optional[str] = None
+    # Metadata filters
+    year: tp.Optional[tp.List[str]] = None
+    rango: tp.Optional[tp.List[str]] = None
+    departamento: tp.Optional[tp.List[str]] = None
+    source_name: tp.Optional[tp.List[str]] = None
+
+
 def timeit(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):